@@ -0,0 +1,161 @@
+from __future__ import division
+import pickle
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score, cohen_kappa_score
+from sklearn.svm import SVC
+
+
+"""
+Leave-one-subject-out training of the sleep stage classifier. The per-subject
+feature matrices are stored once in a shared memory block; fold workers attach
+to it and reference every subject by its row range instead of receiving copies.
+"""
+
+# Label of unscored epochs, as evaluation.MISSING of the sleep_wake package
+MISSING = -1
+
+_worker_store = {}
+
+
+def create_feature_store(subject_features, subject_labels):
+    """
+    Copies the per-subject feature matrices into one shared memory block.
+
+    INPUT
+        subject_features: dict of subject to 2d array of features, one row per epoch
+        subject_labels:   dict of subject to 1d array of stage labels
+
+    OUTPUT
+        blocks: list of SharedMemory blocks, close and unlink them with release_feature_store()
+        store:  dict describing the blocks; small enough to be sent to every worker
+    """
+    subjects = list(subject_features)
+    lengths = [len(subject_features[s]) for s in subjects]
+    stops = np.cumsum(lengths)
+    n_features = np.shape(subject_features[subjects[0]])[1]
+    label_dtype = np.result_type(*[np.asarray(subject_labels[s]).dtype for s in subjects])
+
+    feature_block = shared_memory.SharedMemory(create=True, size=max(int(stops[-1]) * n_features * 8, 1))
+    label_block = shared_memory.SharedMemory(create=True, size=max(int(stops[-1]) * label_dtype.itemsize, 1))
+    store = {'features': feature_block.name, 'labels': label_block.name,
+             'shape': (int(stops[-1]), n_features), 'label_dtype': label_dtype.str,
+             'subjects': subjects, 'ranges': [(int(stop - n), int(stop)) for n, stop in zip(lengths, stops)]}
+
+    features, labels = _store_arrays(feature_block, label_block, store)
+    for subject, (start, stop) in zip(subjects, store['ranges']):
+        features[start:stop] = subject_features[subject]
+        labels[start:stop] = subject_labels[subject]
+
+    return [feature_block, label_block], store
+
+def attach_feature_store(store):
+    """Attaches to the blocks of create_feature_store() and returns (blocks, features, labels) views."""
+    feature_block = shared_memory.SharedMemory(name=store['features'])
+    label_block = shared_memory.SharedMemory(name=store['labels'])
+    features, labels = _store_arrays(feature_block, label_block, store)
+    return [feature_block, label_block], features, labels
+
+def release_feature_store(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+def _store_arrays(feature_block, label_block, store):
+    features = np.ndarray(store['shape'], dtype=np.float64, buffer=feature_block.buf)
+    labels = np.ndarray(store['shape'][:1], dtype=np.dtype(store['label_dtype']), buffer=label_block.buf)
+    return features, labels
+
+def scaling_function(parts):
+    """
+    Mean and standard deviation of every feature over the finite rows of the given
+    row blocks, in the (n_features, 2) form of the scaling functions in models/.
+    Constant features get a standard deviation of 1, like StandardScaler.
+    """
+    finite = [part[np.isfinite(part).all(axis=1)] for part in parts]
+    n = sum(len(part) for part in finite)
+    mean = sum(part.sum(axis=0) for part in finite) / n
+    var = sum(((part - mean) ** 2).sum(axis=0) for part in finite) / n
+    std = np.sqrt(var)
+    std[std == 0] = 1
+    return np.column_stack([mean, std])
+
+def _scaled_training_set(features, labels, ranges, scaling):
+    """Scales the given row ranges into one training matrix, dropping non-finite rows."""
+    train_x = np.concatenate([(features[start:stop] - scaling[:, 0]) / scaling[:, 1] for start, stop in ranges])
+    train_y = np.concatenate([labels[start:stop] for start, stop in ranges])
+    finite = np.isfinite(train_x).all(axis=1)
+    return train_x[finite], train_y[finite]
+
+def _init_worker(store):
+    blocks, features, labels = attach_feature_store(store)
+    _worker_store.update(store=store, blocks=blocks, features=features, labels=labels)
+
+def _train_fold(fold, classifier):
+    store = _worker_store['store']
+    features, labels = _worker_store['features'], _worker_store['labels']
+    start, stop = store['ranges'][fold]
+    train_ranges = [(0, start), (stop, len(labels))]
+
+    scaling = scaling_function([features[a:b] for a, b in train_ranges])
+    train_x, train_y = _scaled_training_set(features, labels, train_ranges, scaling)
+    model = clone(classifier).fit(train_x, train_y)
+
+    # Non-finite epochs stay in place as MISSING so positions match the recording
+    test_x = (features[start:stop] - scaling[:, 0]) / scaling[:, 1]
+    finite = np.isfinite(test_x).all(axis=1)
+    test_y = labels[start:stop]
+    scored = model.predict(test_x[finite])
+    pred = np.full(len(test_y), MISSING, dtype=np.result_type(scored, MISSING))
+    pred[finite] = scored
+    return test_y, pred
+
+def run_loso(subject_features, subject_labels, classifier=SVC(), max_workers=None):
+    """
+    Leave-one-subject-out validation of the stage classifier on a process pool.
+
+    INPUT
+        subject_features: dict of subject to 2d array of features, one row per epoch
+        subject_labels:   dict of subject to 1d array of stage labels
+        classifier:       unfitted scikit-learn classifier, cloned for every fold
+        max_workers:      number of worker processes (default: number of CPUs)
+
+    OUTPUT
+        scores:      DataFrame of scored epochs, accuracy and Cohen's kappa per held out subject
+        predictions: dict of (subject, 'loso') to (true, predicted) stages of every epoch,
+                     epochs with non-finite features predicted as MISSING
+    """
+    blocks, store = create_feature_store(subject_features, subject_labels)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(store,)) as executor:
+            folds = list(executor.map(_train_fold, range(len(store['subjects'])),
+                                      [classifier] * len(store['subjects'])))
+    finally:
+        release_feature_store(blocks)
+
+    predictions = {(subject, 'loso'): fold for subject, fold in zip(store['subjects'], folds)}
+    scored = [(true[pred != MISSING], pred[pred != MISSING]) for true, pred in folds]
+    scores = pd.DataFrame({'subject': store['subjects'],
+                           'epochs': [len(true) for true, pred in scored],
+                           'accuracy': [accuracy_score(true, pred) for true, pred in scored],
+                           'kappa': [cohen_kappa_score(true, pred) for true, pred in scored]})
+    return scores, predictions
+
+def train_final(subject_features, subject_labels, classifier=SVC()):
+    """Fits the scaling function and the classifier on all subjects."""
+    features = np.concatenate([subject_features[s] for s in subject_features])
+    labels = np.concatenate([subject_labels[s] for s in subject_features])
+    scaling = scaling_function([features])
+    train_x, train_y = _scaled_training_set(features, labels, [(0, len(labels))], scaling)
+    return scaling, clone(classifier).fit(train_x, train_y)
+
+def export_model(scaling, classifier, scaling_file, classifier_file):
+    """Pickles the scaling function and classifier like the files in models/."""
+    with open(scaling_file, 'wb') as f:
+        pickle.dump(scaling, f)
+    with open(classifier_file, 'wb') as f:
+        pickle.dump(classifier, f)
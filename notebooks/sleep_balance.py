@@ -0,0 +1,94 @@
+from __future__ import division
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.neighbors import NearestNeighbors
+
+
+"""SMOTE class balancing of training features, also available as sleep_utils.smote_all_minority."""
+
+def _smote_class(train_set, class_index, n_synthetic, out, k_neighbors, seed, chunk_size):
+    """
+    Writes the original rows of one class followed by n_synthetic SMOTE rows into out.
+    Synthetic rows are interpolated between a random row of the class and one of its
+    k nearest neighbors within the class, processed in chunks to bound temporaries.
+    """
+    rng = np.random.default_rng(seed)
+    n_class = len(class_index)
+    np.take(train_set, class_index, axis=0, out=out[:n_class])
+    if n_synthetic == 0:
+        return
+
+    k = min(k_neighbors, n_class - 1)
+    if k > 0:
+        nn = NearestNeighbors(n_neighbors=k + 1).fit(out[:n_class])
+        neighbors = nn.kneighbors(out[:n_class], return_distance=False)[:, 1:]
+    else:
+        neighbors = np.zeros((n_class, 1), dtype=int)
+
+    for start in range(0, n_synthetic, chunk_size):
+        stop = min(start + chunk_size, n_synthetic)
+        sample = rng.integers(0, n_class, stop - start)
+        neighbor = neighbors[sample, rng.integers(0, neighbors.shape[1], stop - start)]
+        gap = rng.random((stop - start, 1))
+        block = out[n_class + start:n_class + stop]
+        np.take(out[:n_class], sample, axis=0, out=block)
+        block += gap * (out[neighbor] - block)
+
+
+def smote_balance(train_set, train_label, k_neighbors=5, random_state=None, n_jobs=None, chunk_size=65536):
+    """
+    Oversamples every minority class with SMOTE up to the size of the majority class.
+    The neighbor index of each minority class is built once on that class alone, and
+    all rows are written directly into one preallocated array, one thread per class.
+    
+    INPUT
+        train_set:    2d array of features, one row per sample
+        train_label:  1d array of labels
+        k_neighbors:  number of nearest neighbors used for interpolation
+        random_state: seed for reproducible oversampling
+        n_jobs:       number of threads (default: one per minority class)
+        chunk_size:   number of synthetic rows generated at a time
+    
+    OUTPUT
+        balanced_data:   2d array, majority rows followed by each minority class
+                         (original rows, then synthetic rows)
+        balanced_labels: 1d array of labels of balanced_data
+        class_slices:    dict of label to the rows of that class in the output
+    """
+    train_set = np.asarray(train_set)
+    train_label = np.asarray(train_label)
+    classes, label_index, counts = np.unique(train_label, return_inverse=True, return_counts=True)
+    majority = np.argmax(counts)
+    n_major = counts[majority]
+    
+    order = [majority] + [c for c in range(len(classes)) if c != majority]
+    dtype = np.result_type(train_set.dtype, np.float64)
+    balanced_data = np.empty((n_major * len(classes), train_set.shape[1]), dtype=dtype)
+    balanced_labels = np.repeat(classes[order], n_major)
+    class_slices = {classes[c]: slice(i * n_major, (i + 1) * n_major) for i, c in enumerate(order)}
+    
+    sorted_index = np.argsort(label_index, kind='stable')
+    class_index = np.split(sorted_index, np.cumsum(counts)[:-1])
+    seeds = np.random.SeedSequence(random_state).spawn(len(classes))
+    
+    with ThreadPoolExecutor(max_workers=n_jobs or max(len(classes) - 1, 1)) as executor:
+        jobs = [executor.submit(_smote_class, train_set, class_index[c], n_major - counts[c],
+                                balanced_data[class_slices[classes[c]]], k_neighbors, seeds[c], chunk_size)
+                for c in order]
+        for job in jobs:
+            job.result()
+    
+    return balanced_data, balanced_labels, class_slices
+
+def smote_all_minority(train_set, train_label, k_neighbors=5, random_state=None, n_jobs=None):
+    """
+    Oversamples every minority class to the size of the majority class. Returns dicts
+    of label to data and labels as views into the single array of smote_balance().
+    """
+    balanced_data, balanced_labels, class_slices = smote_balance(train_set, train_label, k_neighbors,
+                                                                 random_state, n_jobs)
+    
+    oversampled_data = {label: balanced_data[rows] for label, rows in class_slices.items()}
+    oversampled_labels = {label: balanced_labels[rows] for label, rows in class_slices.items()}
+        
+    return oversampled_data, oversampled_labels
@@ -1,15 +1,6 @@
 from __future__ import division
-import os
-import json
+from collections import deque
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import scipy.signal as ss
-import seaborn as sns
-from scipy.ndimage import convolve1d
-import itertools
-from peakdetect import peakdetect
-from imblearn.over_sampling import SMOTE
 
 
 def getwindow(signal, window_duration = 16, window_interval=1, f_s = 4):
@@ -53,6 +44,99 @@ def divide_to_epochs(a, epoch_endindex, epoch_size, fs):
     sig_epochs = [a[x-win_size +1 : x+1] for x in epoch_endindex]
     return np.vstack(sig_epochs)
 
+# Pass bands in Hz of band_filter, respiration is 4 to 65 breaths per minute
+FILTER_BANDS = {'resp': (4/60, 65/60), 'ecg': (0.5, 40.0)}
+
+def fir_band_taps(fs, lowcut, highcut, width=0.05, attenuation=60):
+    """
+    Linear phase band-pass FIR filter, a Kaiser windowed ideal band-pass.
+
+    INPUT
+        fs:          sampling frequency in Hz
+        lowcut:      lower edge of the pass band in Hz, 0 for a low-pass
+        highcut:     upper edge of the pass band in Hz
+        width:       width of the transition bands in Hz, centered on the edges
+        attenuation: stop band attenuation in dB
+
+    OUTPUT
+        taps:        odd number of symmetric filter coefficients
+    """
+    numtaps = int(np.ceil((attenuation - 7.95) / (2.285 * 2 * np.pi * width / fs))) + 1
+    numtaps += 1 - numtaps % 2
+    if attenuation > 50:
+        beta = 0.1102 * (attenuation - 8.7)
+    elif attenuation > 21:
+        beta = 0.5842 * (attenuation - 21) ** 0.4 + 0.07886 * (attenuation - 21)
+    else:
+        beta = 0.0
+    n = np.arange(numtaps) - (numtaps - 1) / 2
+    ideal = 2 * highcut / fs * np.sinc(2 * highcut / fs * n) - 2 * lowcut / fs * np.sinc(2 * lowcut / fs * n)
+    return ideal * np.kaiser(numtaps, beta)
+
+def band_filter(sig, fs, lowcut=None, highcut=None, sigtype='resp', taps=None, block=None, batch=8, n_jobs=None):
+    """
+    Zero-phase FIR band-pass of a whole night with overlap-save FFT convolution.
+    Replaces zeroing the out of band bins of np.fft.fft(sig): the signal is
+    filtered in blocks of real FFTs of next_fast_len size, so memory stays
+    bounded by batch blocks and the blocks can run in parallel threads. The
+    linear phase filter is centered on every sample, so like the FFT mask the
+    response is real (zero-phase) and the output is not delayed.
+
+    INPUT
+        sig:      1d array of the signal
+        fs:       sampling frequency in Hz
+        lowcut:   lower edge of the pass band in Hz (default from sigtype)
+        highcut:  upper edge of the pass band in Hz (default from sigtype)
+        sigtype:  'resp' or 'ecg', see FILTER_BANDS
+        taps:     odd length filter from fir_band_taps(), designed from the band if None
+        block:    minimum FFT length of a block (default: 4 times the filter length)
+        batch:    number of blocks transformed at once
+        n_jobs:   number of threads the batches run on (default: 1)
+
+    OUTPUT
+        filtered: 1d array, same length as sig
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from scipy.fft import next_fast_len, rfft, irfft
+
+    sig = np.asarray(sig, dtype=float)
+    if taps is None:
+        band = FILTER_BANDS[sigtype]
+        taps = fir_band_taps(fs, band[0] if lowcut is None else lowcut, band[1] if highcut is None else highcut)
+    numtaps = len(taps)
+    if numtaps % 2 == 0:
+        raise ValueError('taps must have an odd length to be centered, got %d' % numtaps)
+    delay = (numtaps - 1) // 2
+
+    nfft = next_fast_len(max(block or 0, 4 * numtaps), True)
+    step = nfft - numtaps + 1
+    n = len(sig)
+    n_blocks = -(-n // step)
+    response = rfft(taps, nfft)
+    filtered = np.empty(n)
+
+    def filter_batch(first):
+        last = min(first + batch, n_blocks)
+        segments = np.zeros((last - first, nfft))
+        for i in range(last - first):
+            # Block input starts delay samples before its outputs, outside the signal is zero
+            start = (first + i) * step - delay
+            lo, hi = max(start, 0), min(start + nfft, n)
+            if hi > lo:
+                segments[i, lo - start:hi - start] = sig[lo:hi]
+        valid = irfft(rfft(segments, axis=1) * response, nfft, axis=1)[:, numtaps - 1:]
+        out_lo, out_hi = first * step, min(last * step, n)
+        filtered[out_lo:out_hi] = valid.ravel()[:out_hi - out_lo]
+
+    batches = range(0, n_blocks, batch)
+    if n_jobs is None or n_jobs == 1:
+        for first in batches:
+            filter_batch(first)
+    else:
+        with ThreadPoolExecutor(n_jobs) as executor:
+            list(executor.map(filter_batch, batches))
+    return filtered
+
 def heart_rate(time_peaks):
     dt = time_peaks[1:] - time_peaks[:-1]
     return 1/np.nanmean(dt)
@@ -61,7 +145,149 @@ def heart_rate_var(time_peaks):
     dt = time_peaks[1:] - time_peaks[:-1]
     return np.nanstd(dt)
 
+def rr_tracker(window=30, min_rr=0.3, max_rr=2.0, nn_threshold=0.05):
+    """
+    Incremental RR interval tracker for live or sliding window heart rate features.
+    Feed R peak times in order with rr_update() and read the features of the last
+    window seconds with rr_snapshot(); every beat costs O(1).
+
+    INPUT
+        window:       length in seconds of the rolling window, e.g. the 30 second epoch
+        min_rr:       shortest physiological RR interval in seconds (default: 200 bpm)
+        max_rr:       longest physiological RR interval in seconds (default: 30 bpm)
+                      intervals outside [min_rr, max_rr] are rejected as artifacts
+        nn_threshold: successive difference in seconds counted by pNN50
+
+    OUTPUT
+        tracker:      dict holding the state of the tracker
+    """
+    return {'window': window, 'min_rr': min_rr, 'max_rr': max_rr, 'nn_threshold': nn_threshold,
+            'last_beat': None, 'last_rr': None, 'intervals': deque(), 'rejected': 0, 'beats': 0,
+            'n': 0, 'mean': 0.0, 'm2': 0.0, 'n_diff': 0, 'sum_sq_diff': 0.0, 'nn50': 0}
+
+def rr_update(tracker, beat_time):
+    """Adds one R peak time (seconds) to an rr_tracker()."""
+    last_beat = tracker['last_beat']
+    tracker['last_beat'] = beat_time
+    if last_beat is None:
+        return tracker
+    rr = beat_time - last_beat
+    if not tracker['min_rr'] <= rr <= tracker['max_rr']:
+        # Artifact, also breaks the successive differences
+        tracker['rejected'] += 1
+        tracker['last_rr'] = None
+        return tracker
+    _rr_evict(tracker, beat_time)
+
+    # Welford update of the RR mean and sum of squared deviations
+    tracker['n'] += 1
+    delta = rr - tracker['mean']
+    tracker['mean'] += delta / tracker['n']
+    tracker['m2'] += delta * (rr - tracker['mean'])
+
+    diff = None
+    if tracker['last_rr'] is not None:
+        diff = rr - tracker['last_rr']
+        tracker['n_diff'] += 1
+        tracker['sum_sq_diff'] += diff * diff
+        tracker['nn50'] += abs(diff) > tracker['nn_threshold']
+    tracker['last_rr'] = rr
+    # Interval start, length and difference to the previous interval
+    tracker['intervals'].append([last_beat, rr, diff])
+
+    # Refresh the running sums now and then against drift from the removals
+    tracker['beats'] += 1
+    if tracker['beats'] % 4096 == 0:
+        rrs = np.array([entry[1] for entry in tracker['intervals']])
+        tracker['mean'] = rrs.mean()
+        tracker['m2'] = ((rrs - tracker['mean']) ** 2).sum()
+        diffs = np.array([entry[2] for entry in tracker['intervals'] if entry[2] is not None])
+        tracker['sum_sq_diff'] = (diffs ** 2).sum()
+    return tracker
+
+def _rr_evict(tracker, time):
+    # Intervals starting at or before time - window leave the window with their difference
+    intervals = tracker['intervals']
+    while intervals and intervals[0][0] <= time - tracker['window']:
+        rr = intervals.popleft()[1]
+        tracker['n'] -= 1
+        if tracker['n'] == 0:
+            tracker['mean'] = tracker['m2'] = 0.0
+        else:
+            mean = tracker['mean']
+            tracker['mean'] = mean + (mean - rr) / tracker['n']
+            tracker['m2'] = max(tracker['m2'] - (rr - mean) * (rr - tracker['mean']), 0.0)
+        if intervals and intervals[0][2] is not None:
+            diff = intervals[0][2]
+            intervals[0][2] = None
+            tracker['n_diff'] -= 1
+            tracker['sum_sq_diff'] = max(tracker['sum_sq_diff'] - diff * diff, 0.0)
+            tracker['nn50'] -= abs(diff) > tracker['nn_threshold']
+
+def rr_snapshot(tracker, time):
+    """
+    Heart rate features of the intervals within the window ending at time.
+
+    INPUT
+        tracker:  rr_tracker() fed with every beat up to time
+        time:     end of the window in seconds, e.g. the end of an epoch
+
+    OUTPUT
+        features: dict of
+                  heart_rate:     beats per minute, heart_rate()*60 of the classifier features
+                  heart_rate_var: SDNN in ms, heart_rate_var()*1000 of the classifier features
+                  rmssd:          root mean square of successive differences in ms
+                  pnn50:          percentage of successive differences above nn_threshold
+                  intervals:      number of accepted intervals in the window
+                  rejected:       number of artifacts rejected so far
+    """
+    _rr_evict(tracker, time)
+    n, n_diff = tracker['n'], tracker['n_diff']
+    return {'heart_rate': 1 / tracker['mean'] * 60 if n else np.nan,
+            'heart_rate_var': np.sqrt(tracker['m2'] / n) * 1000 if n else np.nan,
+            'rmssd': np.sqrt(tracker['sum_sq_diff'] / n_diff) * 1000 if n_diff else np.nan,
+            'pnn50': 100 * tracker['nn50'] / n_diff if n_diff else np.nan,
+            'intervals': n,
+            'rejected': tracker['rejected']}
+
+def rr_epochs(peak_times, epoch_ends, **kwargs):
+    """
+    Heart rate features of every epoch from one pass over the R peaks of a night.
+
+    INPUT
+        peak_times: sorted R peak times in seconds
+        epoch_ends: sorted end time of every epoch in seconds, epochs may overlap
+        kwargs:     passed to rr_tracker(), e.g. window=30
+
+    OUTPUT
+        features:   dict of feature name to array with one value per epoch
+    """
+    tracker = rr_tracker(**kwargs)
+    peak_times = np.asarray(peak_times, dtype=float)
+    snapshots = []
+    i = 0
+    for end in epoch_ends:
+        while i < len(peak_times) and peak_times[i] <= end:
+            rr_update(tracker, peak_times[i])
+            i += 1
+        snapshots.append(rr_snapshot(tracker, end))
+    return {key: np.array([snapshot[key] for snapshot in snapshots]) for key in
+            ['heart_rate', 'heart_rate_var', 'rmssd', 'pnn50', 'intervals', 'rejected']}
+
+def _peakdetect():
+    # Compiled lookahead scan of sleep_wake.kernels when Numba is installed, else the peakdetect package
+    try:
+        from sleep_wake import kernels
+        if kernels.numba_enabled():
+            return kernels.peakdetect
+    except ImportError:
+        pass
+    from peakdetect import peakdetect
+    return peakdetect
+
 def bio_signal_peak_detect(sig, fs, sigtype = 'resp'):
+    peakdetect = _peakdetect()
+    
     signaltype = {'resp': fs/2*4, 'ecg': fs/2*2, 'bp': fs/2}
     max_peaks, min_peaks = peakdetect(sig, lookahead = int(signaltype[sigtype]))
     max_peaks_idx, max_peaks_val = zip(*max_peaks)
@@ -98,28 +324,9 @@ def Zero_Crossing_Counts(arr):
     """
     return len(np.where(np.diff(np.sign(arr-np.mean(arr))))[0])
 
-def smote_all_minority(train_set, train_label):
-    sm = SMOTE(kind='regular')
-
-    majority = max(set(train_label), key=list(train_label).count)
-    major_index = np.where(train_label==majority)[0]
-    minorities = list(set(train_label) - set([majority]))
-    
-    majority_data = train_set[major_index, :]
-    majority_labels = train_label[major_index]
-    
-    oversampled_data = {majority: majority_data}
-    oversampled_labels = {majority: majority_labels}
-    
-    for i in minorities:
-        minor_index = np.where(train_label==i)[0]
-        reduced_features = np.concatenate((train_set[major_index, :], train_set[minor_index, :]))
-        reduced_labels = np.concatenate((train_label[major_index], train_label[minor_index]))  
-        train_set_smote, train_label_smote = sm.fit_sample(reduced_features, reduced_labels)
-        
-        new_minor_index = np.where(train_label_smote==i)[0]
-
-        oversampled_data[i] = train_set_smote[new_minor_index, :]
-        oversampled_labels[i] = train_label_smote[new_minor_index]
-        
-    return oversampled_data, oversampled_labels
+def __getattr__(name):
+    # SMOTE helpers need scikit-learn, load them on first use only
+    if name in ('smote_balance', 'smote_all_minority'):
+        import sleep_balance
+        return getattr(sleep_balance, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -1,18 +1,33 @@
 from __future__ import division
 import numpy as np
-import matplotlib.pyplot as plt
 from scipy.signal import butter, lfilter
 
 
 """Bandpass and lowpass filtering functions. """
 
+def _butter_filter(order, Wn, btype, x, chunk_size=1 << 18):
+    """
+    Butterworth filter of float64 data in double precision. Integer and float32 data
+    is filtered in float64 chunks into a float32 output, a float32 filter is unstable
+    (6th order lowpass) or settles into a limit cycle at rest.
+    """
+    b, a = butter(order, Wn, btype=btype)
+    x = np.asarray(x)
+    if x.dtype == np.float64:
+        return lfilter(b, a, x)
+    y = np.empty(len(x), dtype=np.float32)
+    zi = np.zeros(max(len(a), len(b)) - 1)
+    for start in range(0, len(x), chunk_size):
+        y[start:start+chunk_size], zi = lfilter(b, a, x[start:start+chunk_size].astype(np.float64), zi=zi)
+    return y
+
 def bandpass_filter(x, lowcut=10.0, highcut=25.0, samplingRate=50.0, order=5, Plot=True):
     nyq = 0.5 * samplingRate
     low = lowcut / nyq
     high = highcut / nyq
-    b, a = butter(order, [low, high], btype='band')
-    y = lfilter(b, a, x)
+    y = _butter_filter(order, [low, high], 'band', x)
     if Plot:
+        import matplotlib.pyplot as plt
         plt.figure(1, figsize=(20, 2))
         plt.plot(x, 'c-', label='z_raw',)
         plt.grid(True)
@@ -33,7 +48,6 @@ def bandpass_filter(x, lowcut=10.0, highcut=25.0, samplingRate=50.0, order=5, Pl
 def lowpass_filter(data, cutoff, fs, order=6):
     nyq = 0.5 * fs
     normal_cutoff = cutoff / nyq
-    b, a = butter(order, normal_cutoff, btype='low', analog=False)
-    y = lfilter(b, a, data)
+    y = _butter_filter(order, normal_cutoff, 'low', data)
     
     return y
@@ -1,5 +1,4 @@
 import numpy as np
-import pandas as pd
 
 """Rescoring functions used for mitigating misscored actual wake as sleep, and vice versa."""
 
@@ -15,8 +14,50 @@ def consecutive_reverse(data, n, stepsize=1):
             pass
     return lst_
 
+def consecutive_runs(data, n, stepsize=1):
+    """
+    Vectorized consecutive_reverse tests for every prefix and suffix of data.
+
+    Return
+    ----------
+    in_prefix : array_like of bool, length len(data)+1
+        in_prefix[k] is True if consecutive_reverse(data[:k], n) is not empty
+    in_suffix : array_like of bool, length len(data)+1
+        in_suffix[k] is True if consecutive_reverse(data[k:], n) is not empty
+    """
+    data = np.asarray(data)
+    breaks = np.flatnonzero(np.diff(data) != stepsize) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(data)]))
+    run = np.repeat(np.arange(len(starts)), ends - starts)
+    position = np.arange(len(data))
+    in_prefix = np.concatenate(([False], np.logical_or.accumulate(position - starts[run] + 1 >= n)))
+    in_suffix = np.concatenate((np.logical_or.accumulate((ends[run] - position >= n)[::-1])[::-1], [False]))
+    return in_prefix, in_suffix
+
+def fill_between(lower, upper, length):
+    """Indices strictly between every lower and upper bound, in increasing order."""
+    marks = np.zeros(length + 1, dtype=int)
+    np.add.at(marks, np.asarray(lower) + 1, 1)
+    np.add.at(marks, np.asarray(upper), -1)
+    return np.flatnonzero(np.cumsum(marks)[:-1] > 0)
+
+def _rescore_after_wake(data_, gap, count):
+    """rescore2 and rescore3: the next count zeros after a gap of at least gap become ones if consecutive."""
+    data = data_.copy()
+    zero_lst = np.flatnonzero(np.array(data)==0)
+    after_gap = np.flatnonzero(np.diff(zero_lst) >= gap)
+    if after_gap.size and after_gap[-1] + count >= len(zero_lst):
+        raise IndexError('index %d is out of bounds' % (after_gap[-1] + count))
+    after_gap = after_gap[(zero_lst[after_gap + count] - zero_lst[after_gap + 1]) == count - 1]
+    rescored = zero_lst[after_gap[:, np.newaxis] + np.arange(1, count + 1)].ravel()
+    if rescored.size:
+        data.loc[np.unique(rescored)] = 1
+    return data
+
 def rescore1(data_, epoch='S'):
     """After at least 4 minutes scored as wake, the next 1 minute scored as sleep is rescored wake."""
+    import pandas as pd
     data = data_.copy()
     zero_lst = np.flatnonzero(np.array(data)==0)
     if epoch is 'S':
@@ -36,28 +77,12 @@ def rescore1(data_, epoch='S'):
 
 def rescore2(data_):
     """After at least 10 minutes scored as wake, the next 3 minutes scored as sleep are recorded wake."""
-    data = data_.copy()
-    zero_lst = np.flatnonzero(np.array(data)==0)
-    for i in range(len(zero_lst)-1):
-        if (zero_lst[i+1] - zero_lst[i]) >= 10 and (zero_lst[i+3] - zero_lst[i+1]) == 2 :
-            for j in range(1, 4):
-                data.loc[zero_lst[i+j]] = 1
-        else:
-            pass
-    return data
+    return _rescore_after_wake(data_, 10, 3)
 
 
 def rescore3(data_):
     """After at least 15 minutes scored as wake, the next 4 minutes scored as sleep are rescored wake."""
-    data = data_.copy()
-    zero_lst = np.flatnonzero(np.array(data)==0)
-    for i in range(len(zero_lst)-1):
-        if (zero_lst[i+1] - zero_lst[i]) >= 15 and (zero_lst[i+4] - zero_lst[i+1]) == 3 :
-            for j in range(1, 5):
-                data.loc[zero_lst[i+j]] = 1
-        else:
-            pass
-    return data
+    return _rescore_after_wake(data_, 15, 4)
 
 
 def rescore4(data_):
@@ -65,16 +90,14 @@ def rescore4(data_):
         scored as wake are rescored wake"""
     data = data_.copy()
     zero_lst =np.flatnonzero(np.array(data)==1)
-    for i in range(len(zero_lst)-1):
-        if (zero_lst[i+1] - zero_lst[i]) >= 2: 
-            consec1 = consecutive_reverse(zero_lst[:zero_lst[i]], 10)
-            consec2 = consecutive_reverse(zero_lst[zero_lst[i+1]:], 10)
-            if (len(consec1), len(consec2)) > (0, 0):
-                for j in range(zero_lst[i]+1, zero_lst[i+1]):
-                    data.loc[j] = 1
-                else:
-                    pass
-            pass
+    in_prefix, in_suffix = consecutive_runs(zero_lst, 10)
+    lower, upper = zero_lst[:-1], zero_lst[1:]
+    # Runs of wake before lower or from upper on, the slices are by value as in the rule walk
+    rescored = ((upper - lower) >= 2) & (in_prefix[np.minimum(lower, len(zero_lst))]
+                                         | in_suffix[np.minimum(upper, len(zero_lst))])
+    filled = fill_between(lower[rescored], upper[rescored], len(data))
+    if filled.size:
+        data.loc[filled] = 1
     return data
 
 
@@ -121,13 +144,12 @@ def rescored_wake(data_, epoch='S'):
         n = 30
     else:
         n = 15
-    for i in range(len(ones_lst)-1):
-        if (ones_lst[i+1] - ones_lst[i]) <= n:
-            consec1 = consecutive_reverse(ones_lst[:i], 10)
-            consec2 = consecutive_reverse(ones_lst[i+1:], 10)
-            if len(consec1) > 0 and len(consec2) > 0:
-                for j in range(ones_lst[i]+1, ones_lst[i+1]):
-                    data.loc[j] = 1
+    in_prefix, in_suffix = consecutive_runs(ones_lst, 10)
+    i = np.arange(max(len(ones_lst)-1, 0))
+    rescored = ((ones_lst[i+1] - ones_lst[i]) <= n) & in_prefix[i] & in_suffix[i+1]
+    filled = fill_between(ones_lst[i][rescored], ones_lst[i+1][rescored], len(data))
+    if filled.size:
+        data.loc[filled] = 1
     return data
 
 
@@ -175,10 +197,9 @@ def rescored_sleep(data_, epoch='S'):
         n = 30
     else:
         n = 15
-    if ones_lst.size:
-        for i in range(len(ones_lst)-1):
-            if (ones_lst[i+1] - ones_lst[i]) >= n: # and (ones_lst[i+2] - ones_lst[i+1]) > 1 :
-                data.loc[ones_lst[i+1]] = 0
+    rescored = ones_lst[1:][np.diff(ones_lst) >= n]
+    if rescored.size:
+        data.loc[rescored] = 0
     return data
 
 
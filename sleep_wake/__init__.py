@@ -0,0 +1,35 @@
+"""
+Sleep-wake and orientation detection from accelerometer data.
+
+Importing the package only loads NumPy. Submodules that need SciPy (counts),
+pandas (evaluation), worker pools (sweep), asyncio (ingest) or pyarrow (store)
+are imported on first access, e.g. sleep_wake.counts.activity_counts. Stage
+timers are switched on with sleep_wake.profiling.enable().
+"""
+import importlib
+
+from . import profiling
+
+from .sleep_wake import (accel_sleep, accel_sleep_weighted, accel_sleep_orientation, per_second_std,
+                         per_second_stats, sleep_segments, run_length_scores, score_segments)
+from .find_orientation_change import find_orientation_change, orientation_changes, windowed_stats
+from .loaders import load_ichi14, to_units
+from .resample import resample_uniform
+from .scoring import cole_ps, oakley_ps, sazonov_ps
+from .streaming import new_stream, update_stream, stream_results
+
+_LAZY_SUBMODULES = ('counts', 'sweep', 'evaluation', 'ingest', 'store')
+
+#The lazy submodules are listed as well, so a star import loads them
+__all__ = ['accel_sleep', 'accel_sleep_weighted', 'accel_sleep_orientation', 'per_second_std',
+           'per_second_stats', 'sleep_segments', 'run_length_scores', 'score_segments',
+           'find_orientation_change', 'orientation_changes', 'windowed_stats',
+           'load_ichi14', 'to_units', 'resample_uniform', 'cole_ps', 'oakley_ps', 'sazonov_ps',
+           'new_stream', 'update_stream', 'stream_results', 'profiling',
+           'counts', 'sweep', 'evaluation', 'ingest', 'store']
+
+
+def __getattr__(name):
+    if name in _LAZY_SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
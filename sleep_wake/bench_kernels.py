@@ -0,0 +1,29 @@
+import argparse
+
+from .kernels import check_kernels, numba_available
+
+
+"""
+Command line report of kernels.check_kernels(), kept out of the kernels module
+that the package imports:
+
+    python -m sleep_wake.bench_kernels --seconds 28800 --repeat 3
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the compiled kernels with their fallbacks.')
+    parser.add_argument('--seconds', type=int, default=28800, help='length of the synthetic night')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs, the best is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    print('numba %s' % ('installed' if numba_available() else 'not installed, kernels run interpreted'))
+    report = check_kernels(args.seconds, args.repeat, args.seed)
+    for name, row in report.items():
+        print('%-20s identical=%s fallback=%.4fs kernel=%.4fs speedup=%.1fx'
+              % (name, row['identical'], row['fallback_s'], row['kernel_s'], row['speedup']))
+    return 0 if all(row['identical'] for row in report.values()) else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,87 @@
+import numpy as np
+from scipy.signal import butter, lfilter
+
+from .dtypes import compute_dtype, count_dtype
+from .profiling import profiled
+
+
+"""
+Cole and Oakley activity counts computed with reshapes over one second windows
+instead of per-second resampling of a DataFrame. Integer and float32 input is
+filtered into a float32 output, see dtypes.
+"""
+
+FILTER_CHUNK = 1 << 18
+
+@profiled()
+def bandpass(data, lowcut=3.0, highcut=11.0, sample_rate=100, order=1, scale=1.0, offset=0.0):
+    """
+    Butterworth bandpass filter of (data-offset)*scale, as bandpass_filter() without
+    plotting. Raw integer readings can be passed directly with their scale and offset
+    (see loaders); the filter is linear so scaling is applied to the output.
+    """
+    data = np.asarray(data)
+    nyq = 0.5 * sample_rate
+    b, a = butter(order, [lowcut / nyq, highcut / nyq], btype='band')
+
+    #The filter runs in float64 over chunks, only the output is single precision.
+    #A float32 filter settles into a limit cycle at rest, whose sign flips would
+    #add hundreds of zero crossings per epoch to the Cole counts.
+    y = np.empty(len(data), dtype=compute_dtype(data))
+    zi = np.zeros(max(len(a), len(b)) - 1)
+    for start in range(0, len(data), FILTER_CHUNK):
+        x = data[start:start+FILTER_CHUNK].astype(np.float64)
+        if offset:
+            x -= offset
+        chunk, zi = lfilter(b, a, x, zi=zi)
+        if scale != 1:
+            chunk *= scale
+        y[start:start+FILTER_CHUNK] = chunk
+    return y
+
+
+def epoch_sum(per_second, epoch_sec=30, dtype=None):
+    """Sum of per-second values over complete epochs."""
+    n_epochs = len(per_second) // epoch_sec
+    return per_second[:n_epochs*epoch_sec].reshape(n_epochs, epoch_sec).sum(axis=1, dtype=dtype)
+
+
+def epoch_max(data, sample_rate=100, epoch_sec=30):
+    """Maximum of the data over complete epochs."""
+    size = sample_rate * epoch_sec
+    n_epochs = len(data) // size
+    return np.asarray(data)[:n_epochs*size].reshape(n_epochs, size).max(axis=1)
+
+
+@profiled()
+def activity_counts(filtered, sample_rate=100, epoch_sec=30):
+    """
+    Cole and Oakley activity counts per epoch of a bandpass filtered axis.
+
+    Parameters
+    ----------
+    filtered : array_like
+        bandpass filtered accelerometer axis, see bandpass()
+    sample_rate : int
+        (default = 100)
+    epoch_sec : int
+        length of the scoring epochs in seconds (default = 30)
+
+    Return
+    ----------
+    cole_counts : array_like
+        number of zero crossings per epoch, smallest unsigned dtype that fits
+    oakley_counts : array_like
+        sum of the per-second maximum absolute value per epoch, in the dtype of filtered
+    """
+    filtered = np.asarray(filtered)
+    n_sec = len(filtered) // sample_rate
+    seconds = filtered[:n_sec*sample_rate].reshape(n_sec, sample_rate)
+
+    #Zeros count as negative, as in zero_crossing()
+    positive = seconds > 0
+    zero_crossings = (positive[:, 1:] != positive[:, :-1]).sum(axis=1)
+    peaks = np.abs(seconds).max(axis=1)
+
+    cole_dtype = count_dtype((sample_rate - 1) * epoch_sec)
+    return epoch_sum(zero_crossings, epoch_sec, cole_dtype), epoch_sum(peaks, epoch_sec, filtered.dtype)
@@ -0,0 +1,18 @@
+import numpy as np
+
+
+"""
+Dtype policy of the accelerometer pipeline. Raw readings keep their stored integer
+dtype and are scaled lazily; anything that is not already double precision is
+processed in float32 (IIR filters keep their state and arithmetic in float64 over
+chunks), and per-epoch outputs use the smallest dtype that fits.
+"""
+
+def compute_dtype(data):
+    """float64 for float64 input, float32 for integer and single precision input."""
+    return np.float64 if np.asarray(data).dtype == np.float64 else np.float32
+
+
+def count_dtype(max_count):
+    """Smallest unsigned integer dtype holding counts up to max_count."""
+    return np.min_scalar_type(int(max_count))
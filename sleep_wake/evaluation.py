@@ -0,0 +1,219 @@
+import numpy as np
+import pandas as pd
+
+from .profiling import profiled
+
+
+"""
+Cohort evaluation of sleep-wake and sleep stage predictions against PSG epochs.
+Predictions are aligned to the PSG epochs with searchsorted, and confusion
+matrices, Cohen's kappa, TST, WASO, sleep efficiency and sleep onset latency are
+computed for every subject and algorithm at once with bincount reductions.
+"""
+
+MISSING = -1
+
+
+def align_to_epochs(pred_start, pred_label, epoch_start, pred_end=None, missing=MISSING):
+    """
+    Label of the prediction in effect at the start of every PSG epoch.
+
+    Parameters
+    ----------
+    pred_start : array_like
+        sorted start of every prediction (sample index, seconds or datetime64,
+        in the same unit as epoch_start), e.g. the dtime of a rescored column
+    pred_label : array_like
+        predicted label of every prediction
+    epoch_start : array_like
+        start of every PSG epoch
+    pred_end : array_like
+        end of every prediction, if not given a prediction lasts until the next one
+    missing : int
+        label of epochs not covered by any prediction
+
+    Return
+    ----------
+    aligned : array_like
+        predicted label of every PSG epoch
+    """
+    pred_start = np.asarray(pred_start)
+    pred_label = np.asarray(pred_label)
+    epoch_start = np.asarray(epoch_start)
+
+    idx = np.searchsorted(pred_start, epoch_start, side='right') - 1
+    covered = idx >= 0
+    idx = np.clip(idx, 0, None)
+    if pred_end is not None:
+        covered &= epoch_start < np.asarray(pred_end)[idx]
+
+    return np.where(covered, pred_label[idx], missing)
+
+
+def segments_to_epochs(segments, epoch_start, missing=MISSING):
+    """
+    Aligns [start, end, is_sleep] segments from accel_sleep to the PSG epochs,
+    scored as 0 (sleep) and 1 (wake) like the Cole and Oakley scores. Gap segments
+    (is_sleep None) are scored as missing.
+    """
+    if not len(segments):
+        return np.full(len(epoch_start), missing)
+    start, end, is_sleep = zip(*segments)
+    wake = [missing if sleep is None else int(not sleep) for sleep in is_sleep]
+    return align_to_epochs(start, wake, epoch_start, end, missing)
+
+
+def confusion_matrices(group, true, pred, n_groups, n_classes):
+    """
+    Confusion matrix of every group from a single bincount.
+
+    Parameters
+    ----------
+    group : array_like
+        group (subject and algorithm) index of every epoch
+    true, pred : array_like
+        class index (0 to n_classes-1) of every epoch
+
+    Return
+    ----------
+    confusion : array_like, shape (n_groups, n_classes, n_classes)
+        rows are the true classes, columns the predicted classes
+    """
+    flat = (np.asarray(group) * n_classes + true) * n_classes + pred
+    counts = np.bincount(flat, minlength=n_groups * n_classes ** 2)
+    return counts.reshape(n_groups, n_classes, n_classes)
+
+
+def cohens_kappa(confusion):
+    """Cohen's kappa of every confusion matrix along the leading axes."""
+    confusion = np.asarray(confusion, dtype=float)
+    total = confusion.sum(axis=(-2, -1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        observed = np.trace(confusion, axis1=-2, axis2=-1) / total
+        expected = (confusion.sum(axis=-1) * confusion.sum(axis=-2)).sum(axis=-1) / total ** 2
+        return (observed - expected) / (1 - expected)
+
+
+def sleep_metrics(group, position, wake, n_groups, epoch_sec=30):
+    """
+    Sleep parameters of every group.
+
+    Parameters
+    ----------
+    group : array_like
+        group index of every scored epoch
+    position : array_like
+        epoch number within its recording
+    wake : array_like of bool
+        True for wake epochs
+    epoch_sec : int
+        epoch length in seconds
+
+    Return
+    ----------
+    metrics : dict
+        tst - total sleep time (minutes)
+        waso - wake after sleep onset until the last sleep epoch (minutes)
+        se - sleep efficiency, tst over scored time in percent
+        sol - sleep onset latency from the first scored epoch (minutes)
+    """
+    group = np.asarray(group)
+    position = np.asarray(position)
+    wake = np.asarray(wake, dtype=bool)
+    sleep = ~wake
+    minutes = epoch_sec / 60.0
+
+    scored = np.bincount(group, minlength=n_groups) * minutes
+    tst = np.bincount(group, weights=sleep, minlength=n_groups) * minutes
+
+    first = np.full(n_groups, np.iinfo(np.int64).max)
+    np.minimum.at(first, group, position)
+    onset = np.full(n_groups, np.iinfo(np.int64).max)
+    np.minimum.at(onset, group[sleep], position[sleep])
+    final = np.full(n_groups, -1)
+    np.maximum.at(final, group[sleep], position[sleep])
+
+    after_onset = wake & (position > onset[group]) & (position < final[group])
+    waso = np.bincount(group, weights=after_onset, minlength=n_groups) * minutes
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        se = 100 * tst / scored
+    sol = np.where(final >= 0, (onset - first) * minutes, np.nan)
+
+    return {'tst': tst, 'waso': waso, 'se': se, 'sol': sol}
+
+
+@profiled(samples=lambda df: int(df['epochs'].sum()))
+def evaluate_cohort(predictions, classes=(0, 1), wake=(1,), epoch_sec=30, missing=MISSING, path=None):
+    """
+    Evaluates every subject and algorithm in one pass.
+
+    Parameters
+    ----------
+    predictions : dict
+        (subject, algorithm) to a tuple (psg, pred) of epoch aligned labels, e.g.
+        from align_to_epochs() or segments_to_epochs()
+    classes : sequence
+        labels of the confusion matrix; (0, 1) for sleep-wake scores, the stage
+        labels (e.g. 1 to 6) for the stage classifier
+    wake : sequence
+        labels counted as wake for TST, WASO, SE and SOL
+    epoch_sec : int
+        epoch length in seconds (default = 30)
+    missing : int
+        label of unscored epochs, excluded from every result
+    path : string
+        csv file name the results table is written to
+
+    Return
+    ----------
+    df : DataFrame
+        one row per subject and algorithm with accuracy, kappa, sleep parameters
+        of the prediction and the PSG, and the flattened confusion matrix
+    """
+    keys = list(predictions)
+    classes = np.asarray(classes)
+    order = np.argsort(classes)
+    sorted_classes = classes[order]
+    n_classes = len(classes)
+
+    #No predictions give an empty table with the same columns
+    empty = [np.zeros(0, dtype=classes.dtype)]
+    true = np.concatenate(empty + [np.asarray(predictions[key][0]) for key in keys])
+    pred = np.concatenate(empty + [np.asarray(predictions[key][1]) for key in keys])
+    lengths = [len(predictions[key][0]) for key in keys]
+    group = np.repeat(np.arange(len(keys)), lengths)
+    position = np.arange(len(true)) - np.repeat(np.cumsum([0] + lengths)[:-1], lengths)
+
+    #Map labels to class indices, dropping missing or unknown labels
+    true_idx = np.clip(np.searchsorted(sorted_classes, true), 0, n_classes - 1)
+    pred_idx = np.clip(np.searchsorted(sorted_classes, pred), 0, n_classes - 1)
+    valid = ((sorted_classes[true_idx] == true) & (sorted_classes[pred_idx] == pred)
+             & (true != missing) & (pred != missing))
+    group, position = group[valid], position[valid]
+    true, pred = true[valid], pred[valid]
+    true_idx, pred_idx = order[true_idx[valid]], order[pred_idx[valid]]
+
+    confusion = confusion_matrices(group, true_idx, pred_idx, len(keys), n_classes)
+    n_epochs = confusion.sum(axis=(1, 2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        accuracy = np.trace(confusion, axis1=1, axis2=2) / n_epochs
+
+    pred_metrics = sleep_metrics(group, position, np.isin(pred, wake), len(keys), epoch_sec)
+    psg_metrics = sleep_metrics(group, position, np.isin(true, wake), len(keys), epoch_sec)
+
+    df = pd.DataFrame({'subject': [key[0] for key in keys],
+                       'algorithm': [key[1] for key in keys],
+                       'epochs': n_epochs,
+                       'accuracy': accuracy,
+                       'kappa': cohens_kappa(confusion)})
+    for name in ['tst', 'waso', 'se', 'sol']:
+        df[name] = pred_metrics[name]
+        df['psg_' + name] = psg_metrics[name]
+    for i, j in np.ndindex(n_classes, n_classes):
+        df['cm_%s_%s' % (classes[i], classes[j])] = confusion[:, i, j]
+
+    if path is not None:
+        df.to_csv(path, index=False)
+
+    return df
@@ -1,7 +1,12 @@
 import numpy as np
 
+from . import kernels
+from .resample import window_gaps
+from .profiling import profiled
 
-def find_orientation_change(data, time, seconds=60, min_dist=5, min_mean_diff=1, min_duration=7):
+
+@profiled()
+def find_orientation_change(data, time, seconds=60, min_dist=5, min_mean_diff=1, min_duration=7, gaps=None):
     """
     Finds where the orientation of an axis changes in accelerometer data.
 
@@ -29,6 +34,10 @@ def find_orientation_change(data, time, seconds=60, min_dist=5, min_mean_diff=1,
         The minimum number of seconds between the previous orientation change and the
         current candidate.
 
+    gaps: bool array
+        Gap mask of resampled data (see resample.resample_uniform). Windows with gaps
+        get infinite variance so they never start or extend an orientation.
+
     Returns
     ______
 
@@ -50,6 +59,39 @@ def find_orientation_change(data, time, seconds=60, min_dist=5, min_mean_diff=1,
     # Get variance and mean data and the timestamps associated.
     var_data, t = get_windowed_var(data, time, seconds)
     mean_data = get_windowed_mean(data, time, seconds)[0]
+    if gaps is not None:
+        var_data = np.where(window_gaps(gaps, seconds*10, len(var_data)), np.inf, var_data)
+
+    changes = orientation_changes(var_data, mean_data, seconds, min_dist, min_mean_diff, min_duration)
+
+    return changes, var_data, mean_data, t
+
+
+def orientation_changes(var_data, mean_data, seconds=60, min_dist=5, min_mean_diff=1, min_duration=7):
+    """
+    Orientation changes from windowed variance and mean data, e.g. from
+    get_windowed_var/get_windowed_mean or windowed_stats.
+
+    Args
+    ____
+
+    var_data: float array
+        The windowed variance of one accelerometer axis.
+
+    mean_data: float array
+        The windowed mean of the same axis.
+
+    seconds, min_dist, min_mean_diff, min_duration:
+        As in find_orientation_change.
+
+    Returns
+    ______
+
+    changes: array-like
+        A list where each entry is where the orientation begins and ends in seconds.
+    """
+    if kernels.numba_enabled():
+        return kernels.orientation_changes(var_data, mean_data, seconds, min_dist, min_mean_diff, min_duration)
 
     # List to store where the orientation changes take place.
     changes = []
@@ -92,7 +134,7 @@ def find_orientation_change(data, time, seconds=60, min_dist=5, min_mean_diff=1,
 
         i += 1
 
-    return changes, var_data, mean_data, t
+    return changes
 
 
 def get_windowed_var(data, time, window_sec):
@@ -228,3 +270,46 @@ def find_window(data, index):
         if data[i] > 1:
             return i
     return i
+
+
+def windowed_stats(second_mean, second_std, window_sec):
+    """
+    Windowed variance and mean from per-second means and standard deviations
+    (see sleep_wake.per_second_stats), so the raw data does not have to be read
+    again. Matches get_windowed_var and get_windowed_mean, with windows of
+    window_sec consecutive seconds at any sample rate.
+
+    Args
+    ____
+
+    second_mean: float array
+        Mean of every one second window of an axis.
+
+    second_std: float array
+        Standard deviation of every one second window of the same axis.
+
+    window_sec: int
+        How wide the window should be in seconds.
+
+    Returns
+    _______
+
+    variances: float array
+        The windowed variances, the mean within-second variance plus the
+        variance of the second means.
+
+    means: float array
+        The windowed means.
+
+    times: int array
+        The start of every window in seconds.
+    """
+    n_windows = len(second_mean) // window_sec
+    second_mean = np.asarray(second_mean)[:n_windows*window_sec].reshape(n_windows, window_sec)
+    second_std = np.asarray(second_std)[:n_windows*window_sec].reshape(n_windows, window_sec)
+
+    means = second_mean.mean(axis=1)
+    variances = (second_std**2).mean(axis=1) + second_mean.var(axis=1)
+    times = np.arange(n_windows) * window_sec
+
+    return variances, means, times
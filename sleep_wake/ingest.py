@@ -0,0 +1,345 @@
+import argparse
+import asyncio
+import json
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .streaming import new_stream, chunk_stats, apply_stats, stream_snapshot, snapshot_results
+
+
+"""
+Asyncio ingestion service for accelerometer chunks uploaded during the night.
+Chunks are demultiplexed by device into the streaming sleep-wake and orientation
+state of sleep_wake.streaming; the per-second statistics of a chunk are computed
+on a thread (or process) pool and results are served over the same connection.
+
+Messages in both directions are frames of a 4 byte big-endian header length, a
+JSON header and, for chunks, the raw C-ordered array of header['nbytes'] bytes:
+
+    {"type": "chunk", "device": "s8-17", "dtype": "uint8", "shape": [3, 600]} + payload
+    {"type": "query", "device": "s8-17"}
+        -> {"type": "result", "device": "s8-17", "seconds": ..., "sleep": [...], "changes": [...]}
+
+Only queries and malformed messages are answered. A frame whose header is not a
+JSON object, is longer than max_header_bytes or announces a payload beyond
+max_frame_bytes is answered with an error and the connection is closed, since
+the next frame can no longer be found. Chunks of one device are
+scored in arrival order; after a chunk fails to score, the device only answers
+queries with the error.
+When max_pending chunks are queued the server stops reading from the sockets,
+so slow scoring pushes back on the uploading devices through TCP flow control.
+
+For tests, watch_directory() is a file drop stand-in that ingests
+<device>.<sequence>.npy files from an inbox in sequence order and writes
+<device>.json results.
+"""
+
+_HEADER = struct.Struct('>I')
+MAX_HEADER_BYTES = 64 * 1024
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+class FrameError(ValueError):
+    """A frame that cannot be read; the stream position of the next frame is unknown."""
+
+
+async def read_frame(reader, max_header_bytes=MAX_HEADER_BYTES, max_frame_bytes=MAX_FRAME_BYTES):
+    """
+    Reads one (header, payload) frame, raises asyncio.IncompleteReadError at EOF
+    and FrameError if the header is too long, not a JSON object or announces
+    a payload size outside [0, max_frame_bytes].
+    """
+    size = _HEADER.unpack(await reader.readexactly(_HEADER.size))[0]
+    if size > max_header_bytes:
+        raise FrameError('header of %d bytes exceeds %d bytes' % (size, max_header_bytes))
+    try:
+        header = json.loads(await reader.readexactly(size))
+    except ValueError as error:
+        raise FrameError('invalid header: %s' % error)
+    if not isinstance(header, dict):
+        raise FrameError('header is not a JSON object')
+    nbytes = header.get('nbytes', 0)
+    if type(nbytes) is not int or not 0 <= nbytes <= max_frame_bytes:
+        raise FrameError('payload size %r outside [0, %d]' % (nbytes, max_frame_bytes))
+    payload = await reader.readexactly(nbytes) if nbytes else b''
+    return header, payload
+
+
+def write_frame(writer, header, payload=b''):
+    """Writes one frame; await writer.drain() afterwards."""
+    if payload:
+        header = dict(header, nbytes=len(payload))
+    body = json.dumps(header).encode('utf-8')
+    writer.write(_HEADER.pack(len(body)) + body)
+    if payload:
+        writer.write(payload)
+
+
+def chunk_frame(device, data):
+    """Header and payload of a chunk message for an (axes, n) or (n,) array."""
+    data = np.ascontiguousarray(data)
+    header = {'type': 'chunk', 'device': device, 'dtype': data.dtype.str, 'shape': list(data.shape)}
+    return header, data.tobytes()
+
+
+def decode_chunk(header, payload):
+    """Array of a chunk message, raises ValueError, TypeError or KeyError if it is malformed."""
+    return np.frombuffer(payload, dtype=np.dtype(header['dtype'])).reshape(header['shape'])
+
+
+class IngestServer(object):
+    """
+    Per-device streams fed by any number of connections.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        pool the chunk statistics are computed on (default = a thread pool)
+    max_workers : int
+        number of chunks scored at the same time (default = number of CPUs)
+    max_pending : int
+        number of received but unscored chunks before reading is paused
+    max_frame_bytes : int
+        largest accepted chunk payload in bytes
+    **config :
+        detector settings passed to streaming.new_stream() for every device
+    """
+
+    def __init__(self, executor=None, max_workers=None, max_pending=1024, max_frame_bytes=MAX_FRAME_BYTES,
+                 **config):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(self.max_workers)
+        self.max_pending = max_pending
+        self.max_frame_bytes = max_frame_bytes
+        self.config = config
+        self.streams = {}
+        self.errors = {}
+        self._pending = {}
+        self._idle = {}
+        self._ready = None
+        self._slots = None
+        self._workers = []
+        self._servers = []
+
+    async def start(self):
+        """Starts the scoring workers; called by the serve methods."""
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_pending)
+            self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.max_workers)]
+
+    async def serve_tcp(self, host='127.0.0.1', port=0):
+        await self.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        self._servers.append(server)
+        return server
+
+    async def serve_unix(self, path):
+        await self.start()
+        server = await asyncio.start_unix_server(self.handle, path)
+        self._servers.append(server)
+        return server
+
+    async def close(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        if self.own_executor:
+            self.executor.shutdown()
+
+    async def submit(self, device, chunk):
+        """Queues a chunk of a device, waiting while max_pending chunks are queued."""
+        await self._slots.acquire()
+        if device not in self.streams:
+            self.streams[device] = new_stream(**self.config)
+            self._idle[device] = asyncio.Event()
+            self._idle[device].set()
+        pending = self._pending.setdefault(device, [])
+        pending.append(chunk)
+        if self._idle[device].is_set():
+            self._idle[device].clear()
+            self._ready.put_nowait(device)
+
+    async def results(self, device):
+        """Results of a device once all of its queued chunks are scored."""
+        if device not in self.streams:
+            return {'type': 'error', 'device': device, 'error': 'unknown device'}
+        await self._idle[device].wait()
+        if device in self.errors:
+            return {'type': 'error', 'device': device, 'error': self.errors[device]}
+        stream = self.streams[device]
+        if stream['results'] is None:
+            n_seconds = stream['n_seconds']
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self.executor, snapshot_results, stream_snapshot(stream))
+            if stream['n_seconds'] == n_seconds:
+                stream['results'] = results
+        else:
+            results = stream['results']
+        return dict(results, type='result', device=device)
+
+    async def handle(self, reader, writer):
+        """Connection handler, chunks are queued and queries answered in order."""
+        try:
+            while True:
+                try:
+                    header, payload = await read_frame(reader, max_frame_bytes=self.max_frame_bytes)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except FrameError as error:
+                    write_frame(writer, {'type': 'error', 'error': 'malformed frame: %s' % error})
+                    try:
+                        await writer.drain()
+                    except ConnectionError:
+                        pass
+                    break
+                kind = header.get('type')
+                try:
+                    if kind == 'chunk':
+                        await self.submit(header['device'], decode_chunk(header, payload))
+                        continue
+                    if kind == 'query':
+                        reply = await self.results(header['device'])
+                    else:
+                        reply = {'type': 'error', 'error': 'unknown message type %r' % (kind,)}
+                except (KeyError, TypeError, ValueError) as error:
+                    #Frames are length prefixed, so the connection stays usable after a bad message
+                    reply = {'type': 'error', 'device': header.get('device'),
+                             'error': 'malformed %s: %r' % (kind, error)}
+                write_frame(writer, reply)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            device = await self._ready.get()
+            chunks = self._pending.pop(device)
+            stream = self.streams[device]
+            config = stream['config']
+            try:
+                #A bad chunk stops scoring of its device only, later chunks are dropped
+                if device not in self.errors:
+                    data = np.concatenate([np.atleast_2d(c) for c in chunks], axis=1)
+                    stats = await loop.run_in_executor(self.executor, chunk_stats, stream['leftover'], data,
+                                                       config['sample_rate'], config['scale'],
+                                                       config['offset'], config['axis'])
+                    apply_stats(stream, *stats)
+            except Exception as error:
+                self.errors[device] = repr(error)
+            finally:
+                for _ in chunks:
+                    self._slots.release()
+                if device in self._pending:
+                    self._ready.put_nowait(device)
+                else:
+                    self._idle[device].set()
+
+
+async def watch_directory(server, inbox, outbox, interval=1.0, once=False):
+    """
+    File drop stand-in for the socket service.
+
+    Parameters
+    ----------
+    server : IngestServer
+    inbox : string
+        directory polled for <device>.<sequence>.npy chunks, ingested in order
+        of the integer sequence number and deleted. Other names are left alone.
+        A chunk that cannot be loaded yet, e.g. while it is still written, and
+        the later chunks of its device are retried on the next poll.
+    outbox : string
+        directory the <device>.json results are written to after every poll
+    interval : float
+        seconds between polls
+    once : bool
+        return after a single poll
+    """
+    await server.start()
+    while True:
+        names = sorted((_chunk_key(name), name) for name in os.listdir(inbox) if _chunk_key(name))
+        devices = []
+        waiting = set()
+        for (device, _), name in names:
+            if device in waiting:
+                continue
+            path = os.path.join(inbox, name)
+            try:
+                chunk = np.load(path)
+            except (OSError, ValueError, EOFError):
+                waiting.add(device)
+                continue
+            await server.submit(device, chunk)
+            os.remove(path)
+            if device not in devices:
+                devices.append(device)
+        for device in devices:
+            results = await server.results(device)
+            tmp = os.path.join(outbox, device + '.json.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(results, f)
+            os.replace(tmp, os.path.join(outbox, device + '.json'))
+        if once:
+            return
+        await asyncio.sleep(interval)
+
+
+def _chunk_key(name):
+    """(device, sequence) of a <device>.<sequence>.npy file name, None for other names."""
+    parts = name.rsplit('.', 2)
+    if len(parts) != 3 or parts[2] != 'npy' or not parts[1].isdigit():
+        return None
+    return parts[0], int(parts[1])
+
+
+async def _main(args):
+    config = {'sample_rate': args.sample_rate, 'movement_threshold': args.movement_threshold,
+              'sleep_threshold': args.sleep_threshold, 'axis': args.axis,
+              'scale': args.scale, 'offset': args.offset}
+    server = IngestServer(max_workers=args.workers, max_pending=args.max_pending,
+                          max_frame_bytes=args.max_frame_bytes, **config)
+    tasks = []
+    if args.tcp:
+        host, port = args.tcp.rsplit(':', 1)
+        tasks.append((await server.serve_tcp(host, int(port))).serve_forever())
+    if args.unix:
+        tasks.append((await server.serve_unix(args.unix)).serve_forever())
+    if args.inbox:
+        tasks.append(watch_directory(server, args.inbox, args.outbox or args.inbox))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Streaming sleep-wake and orientation ingestion service.')
+    parser.add_argument('--tcp', help='HOST:PORT to listen on')
+    parser.add_argument('--unix', help='unix socket path to listen on')
+    parser.add_argument('--inbox', help='directory of dropped .npy chunks')
+    parser.add_argument('--outbox', help='directory of the results of dropped chunks (default = inbox)')
+    parser.add_argument('--sample-rate', type=int, default=10)
+    parser.add_argument('--movement-threshold', type=float, default=.2)
+    parser.add_argument('--sleep-threshold', type=int, default=6000)
+    parser.add_argument('--axis', type=int, default=2)
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--offset', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-pending', type=int, default=1024)
+    parser.add_argument('--max-frame-bytes', type=int, default=MAX_FRAME_BYTES)
+    args = parser.parse_args(argv)
+    if not (args.tcp or args.unix or args.inbox):
+        parser.error('one of --tcp, --unix or --inbox is required')
+    asyncio.run(_main(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+import os
+import time
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+"""
+Compiled kernels of the sequential scans that do not vectorize: the accel_sleep
+segment scan, the find_orientation_change state machine and the peakdetect
+lookahead scan used by bio_signal_peak_detect. With Numba installed the callers
+switch to the compiled kernels at runtime, otherwise they keep their pure
+Python/NumPy implementations. Compiled kernels are cached to disk (__pycache__,
+or NUMBA_CACHE_DIR if that is not writable) so workers load them instead of
+compiling again.
+
+Set SLEEP_WAKE_KERNELS=python or call use_numba(False) to force the fallbacks.
+check_kernels() compares both implementations and reports the speedups, from the
+command line with python -m sleep_wake.bench_kernels.
+"""
+
+_state = {'numba': numba is not None and os.environ.get('SLEEP_WAKE_KERNELS', '').lower() != 'python'}
+
+
+def numba_available():
+    return numba is not None
+
+
+def numba_enabled():
+    """True if the callers use the compiled kernels."""
+    return _state['numba']
+
+
+def use_numba(enabled=True):
+    """Switches between the compiled kernels and the pure Python/NumPy fallbacks."""
+    if enabled and numba is None:
+        raise ImportError('numba is not installed')
+    _state['numba'] = enabled
+
+
+def _compile(func):
+    if numba is None:
+        return func
+    return numba.njit(cache=True, nogil=True)(func)
+
+
+def _segment_scan(moving, wake, n, sleep_threshold):
+    """Segment scan of sleep_wake.sleep_segments over arrays instead of lists."""
+    size = 2*n + 6
+    starts = np.zeros(size, np.int64)
+    ends = np.zeros(size, np.int64)
+    sleep = np.zeros(size, np.bool_)
+    count = 0
+    n_wake = len(wake)
+
+    start_index = -1
+    j = -1
+    while start_index <= n:
+        start_index += 1
+
+        if moving[min(start_index+sleep_threshold, n)] - moving[min(start_index, n)] != 0:
+            continue
+
+        if count == 0:
+            starts[0] = 0
+            ends[0] = start_index
+            count = 1
+        elif (start_index-ends[count-1]) < (sleep_threshold//3):
+            ends[count-1] = start_index
+        else:
+            starts[count] = ends[count-1]
+            ends[count] = start_index
+            count += 1
+
+        if start_index+sleep_threshold < n:
+            k = np.searchsorted(wake, start_index+sleep_threshold)
+            if k < n_wake:
+                j = wake[k]
+                starts[count] = start_index
+                ends[count] = j
+                sleep[count] = True
+                count += 1
+                start_index = j
+            else:
+                j = n-1
+
+        if j == n-1:
+            starts[count] = start_index
+            ends[count] = j
+            sleep[count] = True
+            count += 1
+            break
+
+    return starts[:count], ends[:count], sleep[:count]
+
+
+def _find_window(var_data, index):
+    i = index
+    for i in range(index, len(var_data)):
+        if var_data[i] > 1:
+            return i
+    return i
+
+
+def _orientation_scan(var_data, mean_data, min_dist, min_mean_diff, min_duration, var_thresh):
+    """State machine of find_orientation_change.orientation_changes in window units."""
+    n = len(var_data)
+    starts = np.zeros(n + 1, np.int64)
+    ends = np.zeros(n + 1, np.int64)
+    count = 0
+
+    i = 0
+    previous_change = 0
+    previous_mean = 1000.0
+    while i < n:
+        if var_data[i] < var_thresh and i >= previous_change + min_dist:
+            mean_diff = abs(previous_mean - mean_data[i])
+
+            if mean_diff >= min_mean_diff:
+                previous_mean = mean_data[i]
+                j = _find_window(var_data, i)
+                if abs(i-j) >= min_duration:
+                    previous_change = j
+                    starts[count] = i
+                    ends[count] = j
+                    count += 1
+                    i = j
+
+        elif var_data[i] < var_thresh and abs(previous_mean - mean_data[i]) <= min_mean_diff:
+            j = _find_window(var_data, i)
+            if count == 0:
+                raise IndexError('list index out of range')
+            ends[count-1] = j
+            previous_change = j
+            previous_mean = mean_data[i]
+
+        i += 1
+
+    return starts[:count], ends[:count]
+
+
+def _peak_scan(y_axis, lookahead, delta):
+    """Lookahead scan of peakdetect.peakdetect with the sample index as x axis."""
+    length = len(y_axis)
+    max_pos = np.zeros(length, np.int64)
+    max_val = np.zeros(length, np.float64)
+    min_pos = np.zeros(length, np.int64)
+    min_val = np.zeros(length, np.float64)
+    n_max = 0
+    n_min = 0
+    first_is_max = -1
+
+    mn = np.inf
+    mx = -np.inf
+    mnpos = 0
+    mxpos = 0
+    for index in range(length - lookahead):
+        y = y_axis[index]
+        if y > mx:
+            mx = y
+            mxpos = index
+        if y < mn:
+            mn = y
+            mnpos = index
+
+        #Maximum candidate, confirmed if nothing ahead is higher
+        if y < mx-delta and mx != np.inf:
+            if y_axis[index:index+lookahead].max() < mx:
+                max_pos[n_max] = mxpos
+                max_val[n_max] = mx
+                n_max += 1
+                if first_is_max == -1:
+                    first_is_max = 1
+                mx = np.inf
+                mn = np.inf
+                if index+lookahead >= length:
+                    break
+                continue
+
+        #Minimum candidate, confirmed if nothing ahead is lower
+        if y > mn+delta and mn != -np.inf:
+            if y_axis[index:index+lookahead].min() > mn:
+                min_pos[n_min] = mnpos
+                min_val[n_min] = mn
+                n_min += 1
+                if first_is_max == -1:
+                    first_is_max = 0
+                mn = -np.inf
+                mx = -np.inf
+                if index+lookahead >= length:
+                    break
+
+    return max_pos[:n_max], max_val[:n_max], min_pos[:n_min], min_val[:n_min], first_is_max
+
+
+_PYTHON = {'segment_scan': _segment_scan, 'orientation_scan': _orientation_scan, 'peak_scan': _peak_scan}
+if numba is not None:
+    _find_window = _compile(_find_window)
+_COMPILED = {name: _compile(func) for name, func in _PYTHON.items()}
+
+
+def _kernel(name):
+    return _COMPILED[name] if _state['numba'] else _PYTHON[name]
+
+
+def sleep_segments(bool_sigma, sleep_threshold):
+    """Kernel version of sleep_wake.sleep_segments, same arguments and result."""
+    bool_sigma = np.asarray(bool_sigma, dtype=bool)
+    moving = np.concatenate(([0], np.cumsum(~bool_sigma)))
+    wake = np.flatnonzero(~bool_sigma).astype(np.int64)
+    starts, ends, sleep = _kernel('segment_scan')(moving, wake, len(bool_sigma), int(sleep_threshold))
+    return [[int(s), int(e), bool(b)] for s, e, b in zip(starts, ends, sleep)]
+
+
+def orientation_changes(var_data, mean_data, seconds=60, min_dist=5, min_mean_diff=1, min_duration=7,
+                        var_thresh=5):
+    """Kernel version of find_orientation_change.orientation_changes, same arguments and result."""
+    starts, ends = _kernel('orientation_scan')(np.asarray(var_data, dtype=np.float64),
+                                               np.asarray(mean_data, dtype=np.float64),
+                                               min_dist, float(min_mean_diff), min_duration, float(var_thresh))
+    return [[int(s)*seconds, int(e)*seconds] for s, e in zip(starts, ends)]
+
+
+def peakdetect(y_axis, lookahead=200, delta=0):
+    """
+    Kernel version of peakdetect.peakdetect(y_axis, lookahead=lookahead, delta=delta)
+    with the default x axis, returning the same [max_peaks, min_peaks] lists of
+    [index, value] pairs.
+    """
+    if lookahead < 1:
+        raise ValueError("Lookahead must be '1' or above in value")
+    if not (np.isscalar(delta) and delta >= 0):
+        raise ValueError("delta must be a positive number")
+    y_axis = np.asarray(y_axis, dtype=np.float64)
+    max_pos, max_val, min_pos, min_val, first_is_max = _kernel('peak_scan')(y_axis, int(lookahead), float(delta))
+
+    #The first hit is almost always false and is dropped like in peakdetect
+    max_peaks = [[int(p), float(v)] for p, v in zip(max_pos, max_val)]
+    min_peaks = [[int(p), float(v)] for p, v in zip(min_pos, min_val)]
+    if first_is_max == 1:
+        max_peaks.pop(0)
+    elif first_is_max == 0:
+        min_peaks.pop(0)
+    return [max_peaks, min_peaks]
+
+
+def check_kernels(n_seconds=28800, repeat=3, seed=0):
+    """
+    Runs every kernel and its fallback on a synthetic night, checks that the
+    outputs are identical and times both. The compiled kernels are warmed up
+    first, so the timings exclude compiling or loading the cache.
+
+    Return
+    ----------
+    report : dict
+        kernel name to identical, fallback_s, kernel_s and speedup; the kernels
+        run interpreted (speedup < 1) when Numba is not installed. peakdetect is
+        only compared when the peakdetect package is installed.
+    """
+    from .sleep_wake import sleep_segments as fallback_segments
+    from .find_orientation_change import orientation_changes as fallback_changes
+
+    rng = np.random.default_rng(seed)
+    moving = rng.random(n_seconds // 60) < .3
+    still = ~(np.repeat(moving, 60) & (rng.random(n_seconds // 60 * 60) < .5))
+    var_data = np.where(rng.random(n_seconds // 60) < .2, 20.0, rng.random(n_seconds // 60) * 2)
+    mean_data = np.repeat(rng.normal(0, 5, n_seconds // 600 + 1), 10)[:len(var_data)]
+    resp = np.sin(np.linspace(0, n_seconds * 2 * np.pi / 4, n_seconds * 25)) + rng.normal(0, .1, n_seconds * 25)
+
+    cases = {'sleep_segments': (fallback_segments, sleep_segments, (still, 600)),
+             'orientation_changes': (fallback_changes, orientation_changes, (var_data, mean_data))}
+    try:
+        from peakdetect import peakdetect as fallback_peaks
+        cases['peakdetect'] = (lambda y, lookahead: fallback_peaks(y, lookahead=lookahead),
+                               lambda y, lookahead: peakdetect(y, lookahead), (resp, 50))
+    except ImportError:
+        pass
+
+    report = {}
+    enabled = _state['numba']
+    try:
+        for name, (fallback, kernel, args) in cases.items():
+            _state['numba'] = False
+            expected, fallback_s = _timed(fallback, args, repeat)
+            _state['numba'] = numba is not None
+            kernel(*args)
+            result, kernel_s = _timed(kernel, args, repeat)
+            report[name] = {'identical': _same(expected, result), 'fallback_s': fallback_s,
+                            'kernel_s': kernel_s, 'speedup': fallback_s / kernel_s}
+    finally:
+        _state['numba'] = enabled
+    return report
+
+
+def _timed(func, args, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def _same(expected, result):
+    #Peak values may come back as numpy scalars, compare nested lists by value
+    if isinstance(expected, (list, tuple)):
+        return (isinstance(result, (list, tuple)) and len(expected) == len(result)
+                and all(_same(a, b) for a, b in zip(expected, result)))
+    return float(expected) == float(result)
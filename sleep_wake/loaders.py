@@ -0,0 +1,79 @@
+import numpy as np
+
+from .profiling import profiled
+
+
+"""
+Loaders that keep accelerometer recordings in their stored compact dtypes. Scaling to
+physical units is left to the processing stages (see the scale and offset arguments
+of accel_sleep, per_second_std and counts.bandpass) or done on demand with to_units.
+"""
+
+ICHI14_RATE = 100
+GRAVITY_OFFSET = 128
+GRAVITY_SCALE = 9.81 / 32
+COUNTS_SCALE = 1 / 4.0
+
+
+@profiled(samples=lambda out: len(out['t']))
+def load_ichi14(file_loc, step=1, expand=True, drop_unknown=True):
+    """
+    Loads an ICHI14 recording without decoding the raw byte counts of the axes.
+
+    Args
+    ____
+
+    file_loc: string
+        npy file name.
+
+    step: int
+        Keep every step-th sample, e.g. 10 for the 10 Hz data used by
+        find_orientation_change and accel_sleep.
+
+    expand: boolean
+        Repeat every stored row by its sample count (column 1) and offset its time
+        stamp by 1/100 s per repetition, as load_sleep does. If False every stored
+        row is one sample, as load_data does.
+
+    drop_unknown: boolean
+        Exclude samples with unknown (0) polysomnography labels.
+
+    Returns
+    _______
+
+    recording: dict
+        't' - time stamp of every sample in days
+        'x', 'y', 'z' - raw axis readings in their stored integer dtype
+        'psg' - polysomnography label of every sample
+    """
+    data = np.load(file_loc)
+    names = data.dtype.names
+    if drop_unknown:
+        data = data[data[names[6]] != 0]
+
+    #Sample indices are int32, a night at 100 Hz is far below 2**31 samples
+    if expand:
+        repeats = data[names[1]]
+        rows = np.repeat(np.arange(len(data), dtype=np.int32), repeats)[::step]
+        within = np.arange(0, len(rows) * step, step, dtype=np.int32)
+        within -= np.repeat((np.cumsum(repeats) - repeats).astype(np.int32), repeats)[::step]
+    else:
+        rows = np.arange(0, len(data), step, dtype=np.int32)
+
+    t = data[names[0]][rows]
+    if expand:
+        t += within * (1.0 / ICHI14_RATE / 60 / 60 / 24)
+
+    return {'t': t,
+            'x': data[names[2]][rows],
+            'y': data[names[3]][rows],
+            'z': data[names[4]][rows],
+            'psg': data[names[6]][rows]}
+
+
+def to_units(raw, scale=GRAVITY_SCALE, offset=GRAVITY_OFFSET):
+    """
+    Scales raw readings to physical units in float32, e.g. (v-128)/32*9.81 for
+    gravity or scale=COUNTS_SCALE, offset=0 for the v/4.0 of load_data.
+    """
+    return (np.asarray(raw, dtype=np.float32) - offset) * np.float32(scale)
@@ -0,0 +1,315 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+
+"""
+Stage level instrumentation of the pipeline. Stages are wrapped in named timers
+that record wall time, CPU time, samples processed and, when enabled, the peak
+tracemalloc allocation. Profiling is off by default; a disabled stage costs one
+flag check. Results of a run are exported as JSON and as a Prometheus text file
+(e.g. for the node_exporter textfile collector) to compare nightly batch runs.
+
+Stages of this package are instrumented already. Functions of the notebooks and
+past_research scripts, or the classifier, are wrapped at runtime:
+
+    profiling.enable(memory=True)
+    profiling.instrument(rescore, ['rescore', 'rescored_wake'])
+    profiling.instrument(classifier, ['predict'], prefix='classifier.', samples=len)
+    ...
+    profiling.write_json('run.json')
+    profiling.write_prometheus('sleep_wake.prom')
+
+Stages run in worker processes (e.g. sweep_cohort) are recorded in the workers
+and not merged into the parent's results. CPU time and the tracemalloc peak are
+process-wide: a stage running while other threads work (e.g. ingest workers or a
+thread pool) is charged their CPU time and allocations as well, only the wall time
+and samples are per call.
+"""
+
+_enabled = False
+_memory = False
+_lock = threading.Lock()
+_local = threading.local()
+_run = {'id': None, 'started': None, 'stages': {}}
+
+
+def enable(memory=False, run_id=None):
+    """
+    Starts recording stages.
+
+    Parameters
+    ----------
+    memory : bool
+        also record the peak allocation of every stage with tracemalloc, which
+        slows down allocation heavy code
+    run_id : string
+        name of the run in the exports (default = start time)
+    """
+    global _enabled, _memory
+    reset(run_id)
+    _memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+
+def disable():
+    """Stops recording; recorded stages are kept until the next enable() or reset()."""
+    global _enabled, _memory
+    _enabled = False
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _memory = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset(run_id=None):
+    """Clears the recorded stages and starts a new run."""
+    started = datetime.now(timezone.utc)
+    with _lock:
+        _run['id'] = run_id or started.strftime('%Y%m%dT%H%M%SZ')
+        _run['started'] = started.isoformat()
+        _run['stages'] = {}
+
+
+class _Stage(object):
+    """Timer of one stage call, set samples inside the with block if not known up front."""
+
+    __slots__ = ('name', 'samples', 'wall', 'cpu', 'base', 'peak')
+
+    def __init__(self, name, samples=0):
+        self.name = name
+        self.samples = samples
+
+    def __enter__(self):
+        stack = _stack()
+        if _memory:
+            current, peak = tracemalloc.get_traced_memory()
+            #Nested stages reset the peak, so the enclosing stages keep what they saw so far
+            for frame in stack:
+                frame.peak = max(frame.peak, peak)
+            tracemalloc.reset_peak()
+            self.base = self.peak = current
+        stack.append(self)
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        stack = _stack()
+        stack.pop()
+        peak_bytes = None
+        if _memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            for frame in stack:
+                frame.peak = max(frame.peak, self.peak)
+            peak_bytes = self.peak - self.base
+        _record(self.name, wall, cpu, self.samples or 0, peak_bytes)
+        return False
+
+
+class _NullStage(object):
+    """Shared no-op stage returned while profiling is disabled."""
+
+    __slots__ = ('samples',)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name, samples=0):
+    """
+    Context manager timing a named stage.
+
+    Parameters
+    ----------
+    name : string
+        stage name, calls with the same name are accumulated
+    samples : int
+        number of samples processed, can also be set on the returned stage
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, samples)
+
+
+def profiled(name=None, samples=0):
+    """
+    Decorator recording every call of a function as a stage.
+
+    Parameters
+    ----------
+    name : string
+        stage name (default = function name)
+    samples : int, callable or None
+        index of the positional argument whose length (last axis) is the number
+        of samples processed, also found when passed by keyword, a callable
+        computing it from the return value, or None to not count samples
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+        keyword = _parameter_name(func, samples) if isinstance(samples, int) else None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            n = 0
+            if isinstance(samples, int):
+                if len(args) > samples:
+                    n = _length(args[samples])
+                elif keyword in kwargs:
+                    n = _length(kwargs[keyword])
+            with _Stage(stage_name, n) as timer:
+                result = func(*args, **kwargs)
+                if callable(samples):
+                    timer.samples = samples(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def instrument(namespace, names, prefix='', samples=0):
+    """
+    Wraps functions of a module, class or object in place, e.g. the rescoring of
+    past_research/rescore.py or the predict method of a classifier. Calls through
+    the namespace, including the module's own internal calls, are then recorded.
+
+    Parameters
+    ----------
+    namespace : module, class or object
+        holder of the functions
+    names : list of strings
+        attribute names of the functions
+    prefix : string
+        prepended to the stage names
+    samples : int, callable or None
+        as in profiled()
+    """
+    for attr in names:
+        func = getattr(namespace, attr)
+        if getattr(func, '__wrapped__', None) is not None:
+            continue
+        setattr(namespace, attr, profiled(prefix + attr, samples)(func))
+
+
+def results():
+    """
+    Recorded stages of the current run.
+
+    Return
+    ----------
+    run : dict
+        id, started and per stage calls, wall_s, cpu_s, samples, samples_per_s
+        and peak_bytes (None without memory profiling)
+    """
+    with _lock:
+        stages = {name: dict(values) for name, values in _run['stages'].items()}
+        run = {'id': _run['id'], 'started': _run['started'], 'stages': stages}
+    for values in stages.values():
+        values['samples_per_s'] = values['samples'] / values['wall_s'] if values['wall_s'] > 0 else None
+    return run
+
+
+def write_json(path):
+    """Writes results() of the current run to a JSON file."""
+    _write_atomic(path, json.dumps(results(), indent=2, sort_keys=True))
+
+
+_PROMETHEUS_METRICS = [
+    ('calls', 'sleep_wake_stage_calls_total', 'counter', 'Number of calls of the stage.'),
+    ('wall_s', 'sleep_wake_stage_wall_seconds_total', 'counter', 'Wall time spent in the stage.'),
+    ('cpu_s', 'sleep_wake_stage_cpu_seconds_total', 'counter', 'Process CPU time spent in the stage.'),
+    ('samples', 'sleep_wake_stage_samples_total', 'counter', 'Samples processed by the stage.'),
+    ('peak_bytes', 'sleep_wake_stage_peak_bytes', 'gauge', 'Largest tracemalloc peak of a call of the stage.'),
+]
+
+
+def prometheus_text():
+    """results() of the current run in the Prometheus text exposition format."""
+    run = results()
+    lines = []
+    for key, metric, kind, help_text in _PROMETHEUS_METRICS:
+        rows = [(name, values[key]) for name, values in sorted(run['stages'].items())
+                if values[key] is not None]
+        if not rows:
+            continue
+        lines.append('# HELP %s %s' % (metric, help_text))
+        lines.append('# TYPE %s %s' % (metric, kind))
+        for name, value in rows:
+            lines.append('%s{run="%s",stage="%s"} %r' % (metric, _escape(run['id']), _escape(name), value))
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path):
+    """Writes prometheus_text() to a file, replacing it atomically for textfile collectors."""
+    _write_atomic(path, prometheus_text())
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _record(name, wall, cpu, samples, peak_bytes):
+    with _lock:
+        values = _run['stages'].get(name)
+        if values is None:
+            values = _run['stages'][name] = {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                             'samples': 0, 'peak_bytes': None}
+        values['calls'] += 1
+        values['wall_s'] += wall
+        values['cpu_s'] += cpu
+        values['samples'] += int(samples)
+        if peak_bytes is not None:
+            values['peak_bytes'] = max(values['peak_bytes'] or 0, peak_bytes)
+
+
+def _parameter_name(func, index):
+    #Name of the positional parameter at index, for calls passing it by keyword
+    try:
+        parameters = list(inspect.signature(func).parameters.values())
+    except (TypeError, ValueError):
+        return None
+    if index < len(parameters) and parameters[index].kind == inspect.Parameter.POSITIONAL_OR_KEYWORD:
+        return parameters[index].name
+    return None
+
+
+def _length(arg):
+    shape = getattr(arg, 'shape', None)
+    if shape is not None:
+        return shape[-1] if len(shape) else 0
+    try:
+        return len(arg)
+    except TypeError:
+        return 0
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomic(path, text):
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
@@ -0,0 +1,111 @@
+import numpy as np
+
+from .dtypes import compute_dtype
+from .profiling import profiled
+
+
+"""
+Resampling of irregularly time stamped accelerometer data (e.g. S8 phones with the
+Gravity app) onto a uniform grid, so that the fixed rate, reshape based windowing of
+the other stages applies. Gaps in the recording are returned as a mask instead of
+being filled with zeros and scored as sleep.
+"""
+
+@profiled()
+def resample_uniform(timestamps, data, sample_rate=10, method='linear', max_gap=1.0):
+    """
+    Maps irregular samples onto a uniform grid in one vectorized pass.
+
+    Parameters
+    ----------
+    timestamps : array_like
+        sorted sample times, in seconds or as datetime64 (S8 nanoseconds: ns / 1e9)
+    data : array_like, shape (N,) or (axes, N)
+        accelerometer readings of every time stamp
+    sample_rate : float
+        rate of the uniform grid in Hz (default = 10)
+    method : string
+        'linear' interpolation, or 'nearest' sample which keeps the dtype of data
+    max_gap : float
+        grid points between two samples further apart than max_gap seconds are gaps
+
+    Returns
+    -------
+    grid : array_like
+        time of every grid point, datetime64 if timestamps are datetime64
+    resampled : array_like, shape (M,) or (axes, M)
+        readings on the grid; gaps are interpolated across and only marked in gaps
+    gaps : array_like of bool
+        True for grid points inside a gap
+    """
+    timestamps = np.asarray(timestamps)
+    data = np.asarray(data)
+    is_datetime = np.issubdtype(timestamps.dtype, np.datetime64)
+    if is_datetime:
+        origin = timestamps[0]
+        seconds = (timestamps - origin) / np.timedelta64(1, 'ns') * 1e-9
+    else:
+        seconds = timestamps.astype(np.float64)
+
+    n_samples = len(seconds)
+    n_grid = int(np.floor((seconds[-1] - seconds[0]) * sample_rate)) + 1
+    grid = seconds[0] + np.arange(n_grid) / float(sample_rate)
+
+    #Samples bracketing every grid point
+    right = np.clip(np.searchsorted(seconds, grid, side='right'), 0, n_samples - 1)
+    left = np.clip(right - 1, 0, n_samples - 1)
+    span = seconds[right] - seconds[left]
+    gaps = span > max_gap
+
+    if method == 'linear':
+        dtype = compute_dtype(data)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(span > 0, (grid - seconds[left]) / span, 0).astype(dtype)
+        lower = data[..., left].astype(dtype)
+        resampled = lower + weight * (data[..., right] - lower)
+    elif method == 'nearest':
+        nearest = np.where(grid - seconds[left] <= seconds[right] - grid, left, right)
+        resampled = data[..., nearest]
+    else:
+        raise ValueError("method must be 'linear' or 'nearest', got %r" % (method,))
+
+    if is_datetime:
+        grid = origin + np.round(grid * 1e9).astype('timedelta64[ns]')
+
+    return grid, resampled, gaps
+
+
+def window_gaps(gaps, window, n_windows=None):
+    """
+    True for every window of consecutive samples that contains a gap.
+
+    Parameters
+    ----------
+    gaps : array_like of bool
+        gap mask from resample_uniform()
+    window : int
+        number of samples per window
+    n_windows : int
+        number of windows, default all complete windows
+    """
+    gaps = np.asarray(gaps, dtype=bool)
+    if n_windows is None:
+        n_windows = len(gaps) // window
+    return gaps[:n_windows*window].reshape(n_windows, window).any(axis=1)
+
+
+def mark_gaps(segments, gap_windows):
+    """
+    Splits [start, end, is_sleep] segments at the gap windows, which become
+    [start, end, None] segments. Windows not covered by any segment are dropped.
+    """
+    labels = np.full(len(gap_windows), -1, dtype=np.int8)
+    for start, end, is_sleep in segments:
+        labels[start:end] = is_sleep
+    labels[np.asarray(gap_windows, dtype=bool)] = 2
+
+    change = np.flatnonzero(np.diff(labels)) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [len(labels)]))
+    state = {0: False, 1: True, 2: None}
+    return [[int(s), int(e), state[labels[s]]] for s, e in zip(starts, ends) if labels[s] != -1]
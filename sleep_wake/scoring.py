@@ -0,0 +1,45 @@
+import numpy as np
+
+from .profiling import profiled
+
+
+"""
+Vectorized Cole, Oakley and Sazonov scores over whole recordings of epoch counts.
+"""
+
+COLE_COEFFS = np.array([1.06, 0.54, 0.58, 0.76, 2.3, 0.74, 0.67])
+OAKLEY_COEFFS = np.array([0.04, 0.2, 2.0, 0.2, 0.04])
+SAZONOV_COEFFS = np.array([0.1945, 0.09746, 0.09975, 0.10194, 0.08917, 0.08108, 0.07494, 0.073, 0.10207][::-1])
+
+
+def rolling_dot(counts, coeffs, fill):
+    """
+    Trailing window dot product of the counts with the coefficients, the
+    vectorized equivalent of pd.rolling_apply(counts, len(coeffs), scoring).
+    The first len(coeffs)-1 values, which have no full window, are set to fill.
+    """
+    counts = np.asarray(counts, dtype=float)
+    window = len(coeffs)
+    scores = np.full(len(counts), fill, dtype=float)
+    if len(counts) >= window:
+        scores[window-1:] = np.lib.stride_tricks.sliding_window_view(counts, window).dot(coeffs)
+    return scores
+
+
+@profiled()
+def cole_ps(cole_counts):
+    """Cole's score per epoch, wake if >= 1. Epochs without a full window score wake."""
+    return rolling_dot(cole_counts, 0.0033 * COLE_COEFFS, 1.0)
+
+
+@profiled()
+def oakley_ps(oakley_counts):
+    """Oakley's counts per minute per epoch, wake above the threshold (20, 40 or 80)."""
+    return rolling_dot(oakley_counts, OAKLEY_COEFFS, np.inf)
+
+
+@profiled()
+def sazonov_ps(epoch_max):
+    """Sazonov's probability of sleep per epoch, sleep above the threshold."""
+    dot = rolling_dot(epoch_max, SAZONOV_COEFFS, np.inf)
+    return 1.0 / (1.0 + np.exp(dot - 1.99604))
@@ -1,7 +1,14 @@
 import numpy as np
 from itertools import groupby
 
-def accel_sleep(vertical, sample_rate=10, movement_threshold=.2, sleep_threshold=6000):
+from . import kernels
+from .dtypes import compute_dtype
+from .resample import window_gaps, mark_gaps
+from .find_orientation_change import orientation_changes, windowed_stats
+from .profiling import profiled
+
+@profiled()
+def accel_sleep(vertical, sample_rate=10, movement_threshold=.2, sleep_threshold=6000, scale=1.0, gaps=None):
     """
     Accepts the vertical component of acceleration (often the Z-axis) and calculates
     periods of sleep and wake. Based on ESS algorithm from Borazio (2014). Expanded to
@@ -10,13 +17,21 @@ def accel_sleep(vertical, sample_rate=10, movement_threshold=.2, sleep_threshold
     Inputs
     ------
     vertical : array-like
-        Acceleration axis aligned parallel to gravity
+        Acceleration axis aligned parallel to gravity, or [3, N] tri-axial data
+        scored on the combined movement of all axes (see per_second_stats)
     sample_rate : int
         Sampling rate of source accelerometer
     movement_threshold : float
         Threshold for whether a frame of data had movement in it. Based on standard deviation.
     sleep_treshold : int
         Unit of analysis for sleep segments in number of readings. Often aroudn 10 minutes
+    scale : float
+        Factor from the readings to the units of movement_threshold, e.g. 9.81/32 for
+        raw ICHI14 byte counts. Offsets do not change the standard deviation, so raw
+        integer readings can be passed without decoding them.
+    gaps : array-like of bool
+        Gap mask of resampled data (see resample.resample_uniform). Seconds with gaps
+        are never counted as still and are returned as [start, end, None] segments.
         
     Returns
     -------
@@ -24,20 +39,205 @@ def accel_sleep(vertical, sample_rate=10, movement_threshold=.2, sleep_threshold
         List of lists containing periods of sleep and wake:
             - [0] : Start of segment index
             - [1] : End of segment index 
-            - [2] : 'Sleep' if True, 'Awake' if False
+            - [2] : 'Sleep' if True, 'Awake' if False, None for gaps
     """
     #Standard deviation in one second windows and thresholded for small movements
-    sleep_threshold /= sample_rate
-    sigma = np.array([np.std(vertical[i:i+sample_rate]) for i in range(0, len(vertical)-sample_rate, sample_rate)])
-    bool_sigma = sigma < .2
+    sleep_threshold = int(sleep_threshold // sample_rate)
+    sigma = movement_sigma(vertical, sample_rate, scale)
+    bool_sigma = sigma < movement_threshold
+    if gaps is not None:
+        gap_seconds = window_gaps(gaps, sample_rate, len(sigma))
+        bool_sigma &= ~gap_seconds
+    
+    sleep_indices = sleep_segments(bool_sigma, sleep_threshold)
+    if gaps is not None:
+        sleep_indices = mark_gaps(sleep_indices, gap_seconds)
+    
+    #Expand data by window size
+    sleep_indices = [[row[0]*sample_rate, row[1]*sample_rate, row[2]] for row in sleep_indices]
+    
+    return sleep_indices
+
+
+def per_second_std(data, sample_rate=10, scale=1.0):
+    """
+    Standard deviation of the data over consecutive, non-overlapping one second
+    windows. Equivalent to np.std of data[i:i+sample_rate] for every i in
+    range(0, len(data)-sample_rate, sample_rate), computed with a single reshape.
+    Integer and float32 readings are reduced in float32 without a float64 copy.
+    
+    Inputs
+    ------
+    data : array-like
+        Accelerometer readings from one axis
+    sample_rate : int
+        Sampling rate of source accelerometer
+    scale : float
+        Factor from the readings to the returned units
+        
+    Returns
+    -------
+    sigma : np.array
+        Standard deviation of each one second window
+    """
+    data = np.asarray(data)
+    dtype = compute_dtype(data)
+    n_windows = max((len(data) - 1) // sample_rate, 0)
+    sigma = data[:n_windows*sample_rate].reshape(n_windows, sample_rate).std(axis=1, dtype=dtype)
+    if scale != 1:
+        sigma *= dtype(scale)
+    return sigma
+
+
+def per_second_stats(data, sample_rate=10, scale=1.0, offset=0.0):
+    """
+    Per-second statistics of tri-axial data from a single reshape of all axes,
+    shared by the sleep-wake scoring and the orientation detector.
+    
+    Inputs
+    ------
+    data : array-like
+        [3, N] accelerometer readings (any number of axes works)
+    sample_rate : int
+        Sampling rate of source accelerometer
+    scale, offset : float
+        Units of the readings, (data-offset)*scale (see loaders)
+        
+    Returns
+    -------
+    stats : dict
+        mean, std - [axes, n] mean and standard deviation of every axis and second
+        magnitude, magnitude_std - [n] mean and standard deviation of the vector magnitude
+        movement - [n] square root of the summed axis variances. Unlike the vertical
+            axis alone it does not depend on how the device is worn, and unlike the
+            magnitude it also sees rotations (e.g. rolling over)
+    """
+    data = np.atleast_2d(np.asarray(data))
+    dtype = compute_dtype(data)
+    n_windows = max((data.shape[-1] - 1) // sample_rate, 0)
+    seconds = data[:, :n_windows*sample_rate].reshape(len(data), n_windows, sample_rate)
+    
+    #Axis statistics, the deviations are reused for the variance
+    mean = seconds.mean(axis=-1, dtype=dtype)
+    deviation = np.subtract(seconds, mean[..., np.newaxis], dtype=dtype)
+    var = np.einsum('...i,...i->...', deviation, deviation) / dtype(sample_rate)
+    
+    #Vector magnitude of every reading, in place in the deviation buffer
+    np.subtract(seconds, dtype(offset), out=deviation, casting='unsafe')
+    deviation *= dtype(scale)
+    deviation **= 2
+    magnitude = np.sqrt(deviation.sum(axis=0))
+    
+    scale = dtype(scale)
+    return {
+        'mean': (mean - dtype(offset)) * scale,
+        'std': np.sqrt(var) * scale,
+        'magnitude': magnitude.mean(axis=-1),
+        'magnitude_std': magnitude.std(axis=-1),
+        'movement': np.sqrt(var.sum(axis=0)) * scale,
+    }
+
+
+def movement_sigma(data, sample_rate=10, scale=1.0):
+    """
+    Per-second movement signal compared against movement_threshold: the standard
+    deviation of a single axis, or the combined movement of [3, N] data.
+    """
+    if np.ndim(data) == 2:
+        return per_second_stats(data, sample_rate, scale)['movement']
+    return per_second_std(data, sample_rate, scale)
+
+
+@profiled()
+def accel_sleep_orientation(data, sample_rate=10, movement_threshold=.2, sleep_threshold=6000, axis=2,
+                            seconds=60, min_dist=5, min_mean_diff=1, min_duration=7, scale=1.0, offset=0.0,
+                            gaps=None):
+    """
+    Sleep-wake segments and orientation changes of tri-axial data from one pass
+    over the readings. The per-second statistics feed both 'accel_sleep' (on the
+    combined movement) and 'find_orientation_change' (on one axis), whose windowed
+    variance and mean are derived from the per-second values.
+    
+    Inputs
+    ------
+    data : array-like
+        [3, N] accelerometer readings
+    sample_rate, movement_threshold, sleep_threshold, gaps :
+        As in 'accel_sleep'
+    axis : int
+        Axis tracked for orientation changes (default = 2, the Z-axis)
+    seconds, min_dist, min_mean_diff, min_duration :
+        As in 'find_orientation_change', the window is seconds long at any sample rate
+    scale, offset : float
+        Units of the readings, (data-offset)*scale (see loaders)
+        
+    Returns
+    -------
+    sleep_indices : list
+        As returned by 'accel_sleep'
+    changes : list
+        [start, end] of every orientation in seconds
+    stats : dict
+        Output of 'per_second_stats', e.g. for epoch features
+    """
+    stats = per_second_stats(data, sample_rate, scale, offset)
+    n_seconds = len(stats['movement'])
+    
+    bool_sigma = stats['movement'] < movement_threshold
+    var_data, mean_data = windowed_stats(stats['mean'][axis], stats['std'][axis], seconds)[:2]
+    if gaps is not None:
+        gap_seconds = window_gaps(gaps, sample_rate, n_seconds)
+        bool_sigma &= ~gap_seconds
+        var_data[window_gaps(gap_seconds, seconds, len(var_data))] = np.inf
+    
+    sleep_indices = sleep_segments(bool_sigma, int(sleep_threshold // sample_rate))
+    if gaps is not None:
+        sleep_indices = mark_gaps(sleep_indices, gap_seconds)
+    sleep_indices = [[row[0]*sample_rate, row[1]*sample_rate, row[2]] for row in sleep_indices]
+    
+    changes = orientation_changes(var_data, mean_data, seconds, min_dist, min_mean_diff, min_duration)
+    
+    return sleep_indices, changes, stats
+
+
+def sleep_segments(bool_sigma, sleep_threshold):
+    """
+    Segment scan used by 'accel_sleep'. Finds every run of at least sleep_threshold
+    still seconds, extends it until the next movement and fills the gaps with awake
+    segments. Window checks use a cumulative count of moving seconds so every step
+    of the scan is constant time.
+    
+    Inputs
+    ------
+    bool_sigma : array-like of bool
+        True for every second without movement
+    sleep_threshold : int
+        Minimum number of still seconds for a segment to count as sleep
+        
+    Returns
+    -------
+    sleep_indices : list
+        List of lists containing periods of sleep and wake in seconds:
+            - [0] : Start of segment index
+            - [1] : End of segment index 
+            - [2] : 'Sleep' if True, 'Awake' if False
+    """
+    if kernels.numba_enabled():
+        return kernels.sleep_segments(bool_sigma, sleep_threshold)
+    
+    bool_sigma = np.asarray(bool_sigma, dtype=bool)
+    n = len(bool_sigma)
+    moving = np.concatenate(([0], np.cumsum(~bool_sigma)))
+    wake = np.flatnonzero(~bool_sigma)
     
     #Find all segments of at least length sleep_threshold and count them as sleep
     start_index = -1
+    j = -1
     sleep_indices = []
-    while start_index <= len(bool_sigma):
+    while start_index <= n:
         start_index += 1
-            
-        if not all(bool_sigma[start_index:start_index+sleep_threshold]):
+        
+        if moving[min(start_index+sleep_threshold, n)] - moving[min(start_index, n)]:
             continue
         
         #Add awake segments and filter out small segments
@@ -47,28 +247,29 @@ def accel_sleep(vertical, sample_rate=10, movement_threshold=.2, sleep_threshold
             sleep_indices[-1][1] = start_index
         else:
             sleep_indices.append([sleep_indices[-1][1], start_index, False])
-            
-        for j in range(start_index+sleep_threshold, len(bool_sigma)):
-            if bool_sigma[j]:
-                continue
-            else:
+        
+        #The first movement after the still window ends the sleep segment
+        if start_index+sleep_threshold < n:
+            k = np.searchsorted(wake, start_index+sleep_threshold)
+            if k < len(wake):
+                j = int(wake[k])
                 sleep_indices.append([start_index, j, True])
                 start_index = j
-                break
+            else:
+                j = n-1
         
         #Add last segment if not already handled
-        if j == len(bool_sigma)-1:
+        if j == n-1:
             sleep_indices.append([start_index, j, True])
             break
     
-    #Expand data by window size
-    sleep_indices = [[row[0]*sample_rate, row[1]*sample_rate, row[2]] for row in sleep_indices]
-    
     return sleep_indices
 
 from itertools import groupby
 
-def accel_sleep_weighted(vertical, sample_rate=10, movement_threshold=.2, sleep_threshold=6000, rl_threshold=.95):
+@profiled()
+def accel_sleep_weighted(vertical, sample_rate=10, movement_threshold=.2, sleep_threshold=6000, rl_threshold=.95,
+                         scale=1.0, gaps=None):
     """
     Accepts the vertical component of acceleration (often the Z-axis) and calculates
     periods of sleep and wake. Based on ESS algorithm from Borazio (2014). Expanded to
@@ -80,13 +281,21 @@ def accel_sleep_weighted(vertical, sample_rate=10, movement_threshold=.2, sleep_
     Inputs
     ------
     vertical : array-like
-        Acceleration axis aligned parallel to gravity
+        Acceleration axis aligned parallel to gravity, or [3, N] tri-axial data
+        scored on the combined movement of all axes (see per_second_stats)
     sample_rate : int
         Sampling rate of source accelerometer
     movement_threshold : float
         Threshold for whether a frame of data had movement in it. Based on standard deviation.
     sleep_treshold : int
         Unit of analysis for sleep segments in number of readings. Often aroudn 10 minutes
+    scale : float
+        Factor from the readings to the units of movement_threshold, e.g. 9.81/32 for
+        raw ICHI14 byte counts. Offsets do not change the standard deviation, so raw
+        integer readings can be passed without decoding them.
+    gaps : array-like of bool
+        Gap mask of resampled data (see resample.resample_uniform). Seconds with gaps
+        are never counted as still and are returned as [start, end, None] segments.
     rl_threshold : float (0.0-1.0)
         Threshold on average run length score. Higher values predict more wake.
         
@@ -96,12 +305,42 @@ def accel_sleep_weighted(vertical, sample_rate=10, movement_threshold=.2, sleep_
         List of lists containing periods of sleep and wake:
             - [0] : Start of segment index
             - [1] : End of segment index 
-            - [2] : 'Sleep' if True, 'Awake' if False
+            - [2] : 'Sleep' if True, 'Awake' if False, None for gaps
     """
     #Standard deviation in size of one second and thresholded
-    sleep_threshold /= sample_rate
-    sigma = np.array([np.std(vertical[i:i+sample_rate]) for i in range(0, len(vertical)-sample_rate, sample_rate)])
+    sleep_threshold = int(sleep_threshold // sample_rate)
+    sigma = movement_sigma(vertical, sample_rate, scale)
     bool_sigma = sigma < movement_threshold
+    if gaps is not None:
+        gap_seconds = window_gaps(gaps, sample_rate, len(sigma))
+        bool_sigma &= ~gap_seconds
+    sleep_scores = run_length_scores(bool_sigma, sleep_threshold)
+    
+    #Treshold scores and filter out small segments
+    sleep_indices = score_segments(sleep_scores < rl_threshold)
+    if gaps is not None:
+        sleep_indices = mark_gaps(sleep_indices, gap_seconds)
+    return sleep_indices
+
+
+def run_length_scores(bool_sigma, sleep_threshold):
+    """
+    Run length weighted score of every second used by 'accel_sleep_weighted'.
+    Independent of rl_threshold, so it only needs to be computed once when
+    comparing several thresholds.
+    
+    Inputs
+    ------
+    bool_sigma : array-like of bool
+        True for every second without movement
+    sleep_threshold : int
+        Unit of analysis for sleep segments in seconds
+        
+    Returns
+    -------
+    sleep_scores : np.array
+        Run length weighted score of each scored second
+    """
     rl_sigma = [[key, sum(1 for i in group)] for key,group in groupby(bool_sigma)]
     
     #Find segments of 10 minutes and score based on run length weighting
@@ -117,7 +356,7 @@ def accel_sleep_weighted(vertical, sample_rate=10, movement_threshold=.2, sleep_
             segment_score = np.mean([(pair[1]/arl)*pair[0] for pair in segment])
 
             sleep_scores.extend([segment_score]*segment_size)
-            sleep_scores.extend([int(test[i][0])]*test[i][1])
+            sleep_scores.extend([int(rl_sigma[i][0])]*rl_sigma[i][1])
 
         elif segment_size > sleep_threshold:
             start_index = i
@@ -126,12 +365,28 @@ def accel_sleep_weighted(vertical, sample_rate=10, movement_threshold=.2, sleep_
 
             sleep_scores.extend([segment_score]*segment_size)
     
-    #Treshold scores and filter out small segments
-    bool_scores = np.array(sleep_scores) < rl_threshold
+    return np.array(sleep_scores)
+
+
+def score_segments(bool_scores):
+    """
+    Turns thresholded run length scores into sleep and wake segments, merging
+    wake runs shorter than 3 minutes into the preceding segment.
+    
+    Inputs
+    ------
+    bool_scores : array-like of bool
+        True for every second whose run length score is below rl_threshold
+        
+    Returns
+    -------
+    sleep_indices : list
+        List of [start, end, is_sleep] in seconds
+    """
     rl_scores = [[key, sum(1 for i in group)] for key,group in groupby(bool_scores)]
     
     sleep_indices = []
-    for pair in score_rl:
+    for pair in rl_scores:
 
         if not sleep_indices:
             sleep_indices.append([0, pair[1], not pair[0]])
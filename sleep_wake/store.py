@@ -0,0 +1,271 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+"""
+Columnar store of per-epoch results (accel_sleep segments aligned with
+evaluation.segments_to_epochs, Cole/Oakley or rescored columns, PE series,
+classifier stages and their features) for queries across many nights.
+
+Every subject, night and algorithm is a Parquet partition
+
+    root/subject=<subject>/night=<night>/algorithm=<algorithm>/epochs.parquet
+    root/subject=<subject>/night=<night>/algorithm=<algorithm>/runs.parquet
+    root/subject=<subject>/night=<night>/algorithm=<algorithm>/_index.parquet
+
+epochs holds the epoch start, stage and feature columns, runs the run-length
+encoded stages (start, epochs, stage) and _index the one row index entry of the
+partition (subject, night, algorithm, time range). Writers only touch their own
+partition, so jobs can write nights concurrently. compact_index() merges the
+entries into root/_index.parquet; read_index() combines it with the entries
+written since. Queries select partitions from the index and read only the
+requested columns, e.g. stage fractions come from the runs alone.
+"""
+
+INDEX_FILE = '_index.parquet'
+INDEX_COLUMNS = ['subject', 'night', 'algorithm', 'start', 'end', 'epochs', 'runs', 'epoch_sec', 'path']
+PARTITIONS = os.path.join('subject=*', 'night=*', 'algorithm=*')
+
+
+def rle_encode(stage):
+    """
+    Run-length encoding of a stage column.
+
+    Return
+    ----------
+    first : array_like
+        index of the first epoch of every run
+    length : array_like
+        number of epochs of every run
+    value : array_like
+        stage of every run
+    """
+    stage = np.asarray(stage)
+    if not len(stage):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), stage[:0]
+    change = np.flatnonzero(stage[1:] != stage[:-1]) + 1
+    first = np.concatenate(([0], change))
+    length = np.diff(np.concatenate((first, [len(stage)])))
+    return first, length, stage[first]
+
+
+def rle_decode(length, value):
+    """Stage column of rle_encode() runs."""
+    return np.repeat(np.asarray(value), np.asarray(length))
+
+
+def write_night(root, subject, night, algorithm, epoch_start, stage, features=None, epoch_sec=30):
+    """
+    Writes the per-epoch output of one algorithm for one night and its index
+    entry. An existing partition of the same subject, night and algorithm is
+    replaced.
+
+    Parameters
+    ----------
+    root : string
+        store directory
+    subject, night, algorithm : string
+        partition keys, e.g. 'p01', '2017-03-02' and 'cole_rescored'
+    epoch_start : array_like
+        sorted start of every epoch, datetime64 or seconds
+    stage : array_like
+        stage or sleep-wake label of every epoch
+    features : dict or DataFrame
+        feature columns, one value per epoch
+    epoch_sec : int
+        epoch length in seconds
+
+    Return
+    ----------
+    path : string
+        partition directory
+    """
+    epoch_start = np.asarray(epoch_start)
+    stage = np.asarray(stage)
+    path = os.path.join('subject=%s' % subject, 'night=%s' % night, 'algorithm=%s' % algorithm)
+    directory = os.path.join(root, path)
+    os.makedirs(directory, exist_ok=True)
+
+    columns = {'start': epoch_start, 'stage': stage}
+    if features is not None:
+        for name in features:
+            columns[name] = np.asarray(features[name])
+    epochs = pa.table(columns)
+    _write_table(epochs, os.path.join(directory, 'epochs.parquet'))
+
+    first, length, value = rle_encode(stage)
+    runs = pa.table({'start': epoch_start[first], 'epochs': length, 'stage': value})
+    _write_table(runs, os.path.join(directory, 'runs.parquet'))
+
+    entry = pd.DataFrame({'subject': [str(subject)], 'night': [str(night)], 'algorithm': [str(algorithm)],
+                          'start': epoch_start[:1] if len(epoch_start) else [None],
+                          'end': epoch_start[-1:] if len(epoch_start) else [None],
+                          'epochs': [len(stage)], 'runs': [len(length)], 'epoch_sec': [epoch_sec],
+                          'path': [path]})
+    #Written last, a partition is only indexed once its files are complete
+    _write_table(pa.Table.from_pandas(entry, preserve_index=False), os.path.join(directory, INDEX_FILE))
+    return directory
+
+
+def read_index(root):
+    """
+    Index of every partition in the store, empty if nothing was written yet.
+    Entries of root/_index.parquet are used as long as the partition entry is
+    unchanged, other partition entries are read from the partitions.
+    """
+    compacted = _read_compacted(root)
+    known = dict(zip(compacted['path'], zip(compacted['inode'], compacted['mtime'])))
+    keep = []
+    fresh = []
+    for path, version in _partition_entries(root):
+        if known.get(path) == version:
+            keep.append(path)
+        else:
+            fresh.append(pq.read_table(os.path.join(root, path, INDEX_FILE)).to_pandas())
+    tables = [compacted[compacted['path'].isin(keep)][INDEX_COLUMNS]] + fresh
+    tables = [table for table in tables if len(table)]
+    if not tables:
+        return pd.DataFrame({name: [] for name in INDEX_COLUMNS})
+    return pd.concat(tables, ignore_index=True)
+
+
+def compact_index(root):
+    """
+    Merges the index entries of all partitions into root/_index.parquet, so that
+    read_index() does not open every partition. Safe to run while nights are
+    written, entries written in the meantime are read from their partitions.
+
+    Return
+    ----------
+    index : DataFrame
+        compacted index
+    """
+    entries = []
+    for path, (inode, mtime) in _partition_entries(root):
+        entry = pq.read_table(os.path.join(root, path, INDEX_FILE)).to_pandas()
+        entry['inode'] = inode
+        entry['mtime'] = mtime
+        entries.append(entry)
+    if entries:
+        index = pd.concat(entries, ignore_index=True)
+    else:
+        index = pd.DataFrame({name: [] for name in INDEX_COLUMNS + ['inode', 'mtime']})
+    _write_table(pa.Table.from_pandas(index, preserve_index=False), os.path.join(root, INDEX_FILE))
+    return index[INDEX_COLUMNS]
+
+
+def query_index(root, subjects=None, nights=None, algorithms=None, start=None, end=None, last_nights=None):
+    """
+    Partitions matching the filters.
+
+    Parameters
+    ----------
+    subjects, nights, algorithms : sequence
+        keep only these partition keys
+    start, end : datetime64 or float
+        keep nights overlapping [start, end]
+    last_nights : int
+        keep only the latest nights of every subject and algorithm
+    """
+    index = read_index(root)
+    if subjects is not None:
+        index = index[index['subject'].isin([str(s) for s in subjects])]
+    if nights is not None:
+        index = index[index['night'].isin([str(n) for n in nights])]
+    if algorithms is not None:
+        index = index[index['algorithm'].isin([str(a) for a in algorithms])]
+    if start is not None:
+        index = index[index['end'] >= start]
+    if end is not None:
+        index = index[index['start'] <= end]
+    if last_nights is not None:
+        index = index.sort_values('start').groupby(['subject', 'algorithm']).tail(last_nights)
+    return index.sort_values(['subject', 'start', 'algorithm']).reset_index(drop=True)
+
+
+def read_epochs(root, columns=None, **filters):
+    """
+    Per-epoch rows of the matching partitions; filters as in query_index().
+
+    Parameters
+    ----------
+    columns : sequence
+        epoch columns to read besides the partition keys, default all. Only the
+        column chunks of these columns are read from the files.
+    """
+    return _read_partitions(root, 'epochs.parquet', columns, filters)
+
+
+def read_runs(root, **filters):
+    """Run-length encoded stages (start, epochs, stage) of the matching partitions."""
+    return _read_partitions(root, 'runs.parquet', None, filters)
+
+
+def stage_fractions(root, stages, **filters):
+    """
+    Fraction of epochs scored as any of the given stages per subject and
+    algorithm, e.g. the REM fraction over the last 30 nights with
+    stage_fractions(root, [4], algorithms=['svc'], last_nights=30). Only the
+    runs and the index are read.
+
+    Return
+    ----------
+    df : DataFrame
+        subject, algorithm, nights, epochs and fraction
+    """
+    runs = read_runs(root, **filters)
+    if not len(runs):
+        return pd.DataFrame({'subject': [], 'algorithm': [], 'nights': [], 'epochs': [], 'fraction': []})
+    runs['matched'] = np.where(runs['stage'].isin(list(stages)), runs['epochs'], 0)
+    grouped = runs.groupby(['subject', 'algorithm'])
+    df = pd.DataFrame({'nights': grouped['night'].nunique(),
+                       'epochs': grouped['epochs'].sum(),
+                       'matched': grouped['matched'].sum()}).reset_index()
+    df['fraction'] = df['matched'] / df['epochs']
+    return df.drop(columns='matched')
+
+
+def _partition_entries(root):
+    """
+    Path relative to root and version of every partition index entry. Entries are
+    replaced atomically, so a new inode or modification time means a new entry.
+    """
+    for entry in glob.glob(os.path.join(glob.escape(root), PARTITIONS, INDEX_FILE)):
+        try:
+            stat = os.stat(entry)
+        except FileNotFoundError:
+            continue
+        yield os.path.relpath(os.path.dirname(entry), root), (stat.st_ino, stat.st_mtime_ns)
+
+
+def _read_compacted(root):
+    path = os.path.join(root, INDEX_FILE)
+    if not os.path.exists(path):
+        return pd.DataFrame({name: [] for name in INDEX_COLUMNS + ['inode', 'mtime']})
+    return pq.read_table(path).to_pandas()
+
+
+def _read_partitions(root, name, columns, filters):
+    index = query_index(root, **filters)
+    tables = []
+    for row in index.itertuples():
+        table = pq.read_table(os.path.join(root, row.path, name), columns=columns).to_pandas()
+        table.insert(0, 'algorithm', row.algorithm)
+        table.insert(0, 'night', row.night)
+        table.insert(0, 'subject', row.subject)
+        tables.append(table)
+    if not tables:
+        return pd.DataFrame({'subject': [], 'night': [], 'algorithm': []})
+    return pd.concat(tables, ignore_index=True)
+
+
+def _write_table(table, path):
+    #Dictionary encoding stores the sorted, repetitive stage and key columns as RLE runs
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    pq.write_table(table, tmp, use_dictionary=True, compression='zstd')
+    os.replace(tmp, path)
@@ -0,0 +1,136 @@
+import numpy as np
+
+from .sleep_wake import per_second_stats, sleep_segments
+from .find_orientation_change import orientation_changes, windowed_stats
+
+
+"""
+Streaming state of the sleep-wake (accel_sleep) and orientation
+(find_orientation_change) detectors for data that arrives in chunks during the
+night. A stream only keeps the still flag of every second, the windowed variance
+and mean of the orientation axis and the samples of the last incomplete second,
+so a full night of one device takes a few tens of kilobytes. The results over
+all chunks so far equal accel_sleep_orientation on the concatenated data.
+
+chunk_stats is pure and only receives the chunk, so it can run on a thread or
+process pool; apply_stats then updates the stream in the owning thread.
+"""
+
+def new_stream(sample_rate=10, movement_threshold=.2, sleep_threshold=6000, axis=2, seconds=60,
+               min_dist=5, min_mean_diff=1, min_duration=7, scale=1.0, offset=0.0):
+    """
+    Empty stream of one device, arguments as in accel_sleep_orientation.
+
+    Return
+    ----------
+    stream : dict
+        state updated by update_stream() or apply_stats()
+    """
+    return {
+        'config': {'sample_rate': sample_rate, 'movement_threshold': movement_threshold,
+                   'sleep_threshold': sleep_threshold, 'axis': axis, 'seconds': seconds,
+                   'min_dist': min_dist, 'min_mean_diff': min_mean_diff,
+                   'min_duration': min_duration, 'scale': scale, 'offset': offset},
+        'leftover': None,
+        'still': [],
+        'n_seconds': 0,
+        'second_mean': np.empty(0, dtype=np.float32),
+        'second_std': np.empty(0, dtype=np.float32),
+        'window_var': [],
+        'window_mean': [],
+        'results': None,
+    }
+
+
+def chunk_stats(leftover, chunk, sample_rate=10, scale=1.0, offset=0.0, axis=2):
+    """
+    Per-second statistics of the complete seconds of a chunk.
+
+    Parameters
+    ----------
+    leftover : array_like or None
+        samples of the previous chunk not yet scored (stream['leftover'])
+    chunk : array_like, shape (axes, n) or (n,)
+        new accelerometer readings, contiguous with the previous chunk
+
+    Return
+    ----------
+    movement, second_mean, second_std : array_like
+        combined movement and orientation axis mean and std of every new second
+    leftover : array_like
+        samples kept for the next chunk. Like per_second_stats at least one sample
+        is kept, so the seconds add up to those of the concatenated data.
+    """
+    chunk = np.atleast_2d(chunk)
+    data = chunk if leftover is None else np.concatenate([leftover, chunk.astype(leftover.dtype)], axis=1)
+    stats = per_second_stats(data, sample_rate, scale, offset)
+    n_seconds = len(stats['movement'])
+    return stats['movement'], stats['mean'][axis], stats['std'][axis], data[:, n_seconds*sample_rate:].copy()
+
+
+def apply_stats(stream, movement, second_mean, second_std, leftover):
+    """Adds the output of chunk_stats() to the stream."""
+    config = stream['config']
+    seconds = config['seconds']
+    stream['still'].append(movement < config['movement_threshold'])
+    stream['n_seconds'] += len(movement)
+    stream['leftover'] = leftover
+
+    #Windowed orientation statistics of every completed window
+    second_mean = np.concatenate([stream['second_mean'], second_mean])
+    second_std = np.concatenate([stream['second_std'], second_std])
+    var_data, mean_data = windowed_stats(second_mean, second_std, seconds)[:2]
+    stream['window_var'].extend(var_data.tolist())
+    stream['window_mean'].extend(mean_data.tolist())
+    stream['second_mean'] = second_mean[len(var_data)*seconds:]
+    stream['second_std'] = second_std[len(var_data)*seconds:]
+
+    if len(movement):
+        stream['results'] = None
+    return stream
+
+
+def update_stream(stream, chunk):
+    """Scores a chunk of one device in the calling thread."""
+    config = stream['config']
+    stats = chunk_stats(stream['leftover'], chunk, config['sample_rate'], config['scale'],
+                        config['offset'], config['axis'])
+    return apply_stats(stream, *stats)
+
+
+def stream_snapshot(stream):
+    """Copy of everything stream_results() needs, safe to score outside the owning thread."""
+    if len(stream['still']) > 1:
+        stream['still'] = [np.concatenate(stream['still'])]
+    still = stream['still'][0] if stream['still'] else np.zeros(0, dtype=bool)
+    return {'config': stream['config'], 'n_seconds': stream['n_seconds'], 'still': still,
+            'window_var': np.array(stream['window_var']), 'window_mean': np.array(stream['window_mean'])}
+
+
+def snapshot_results(snapshot):
+    """
+    Sleep-wake segments and orientation changes of a stream_snapshot().
+
+    Return
+    ----------
+    results : dict
+        seconds - number of scored seconds
+        sleep - [start, end, is_sleep] segments in samples as returned by accel_sleep
+        changes - [start, end] of every orientation in seconds
+    """
+    config = snapshot['config']
+    sample_rate = config['sample_rate']
+    segments = sleep_segments(snapshot['still'], int(config['sleep_threshold'] // sample_rate))
+    segments = [[row[0]*sample_rate, row[1]*sample_rate, row[2]] for row in segments]
+    changes = []
+    if len(snapshot['window_var']):
+        changes = orientation_changes(snapshot['window_var'], snapshot['window_mean'], config['seconds'],
+                                      config['min_dist'], config['min_mean_diff'], config['min_duration'])
+    return {'seconds': snapshot['n_seconds'], 'sleep': segments, 'changes': changes}
+
+
+def stream_results(stream):
+    """Results of all chunks so far, cached until the next scored second."""
+    if stream['results'] is None:
+        stream['results'] = snapshot_results(stream_snapshot(stream))
+    return stream['results']
@@ -0,0 +1,315 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from .counts import bandpass, activity_counts, epoch_max
+from .scoring import cole_ps, oakley_ps, sazonov_ps
+from .sleep_wake import per_second_std
+from .profiling import profiled
+
+
+"""
+Single pass threshold sweeps for the sleep-wake algorithms. The filtered signal,
+per-second sigma, activity counts and model scores of a subject are computed once
+and every threshold of the grid is then evaluated against the PSG labels with
+broadcasted comparisons.
+
+Like the notebooks, Cole is scored on epoch_sec epochs and Oakley and Sazonov on
+one minute epochs (oakley() and Sazonov_Algorithm); accel_sleep is evaluated per
+second with its still window given in seconds, independent of the sample rate.
+"""
+
+MINUTE_SEC = 60
+
+DEFAULT_GRID = {
+    'oakley': [20, 40, 80],
+    'sazonov': np.round(np.arange(0.05, 1.0, 0.05), 2),
+    'movement_threshold': [.05, .1, .2, .4],
+    'sleep_sec': [300, 600, 900],
+    'rl_threshold': [.85, .9, .95, .99],
+}
+
+
+def psg_wake(psg):
+    """Wake (1) or sleep (0) from the PSG labels, unknown (0) and 6/7 count as wake."""
+    psg = np.asarray(psg)
+    return (psg > 5) | (psg == 0)
+
+
+@profiled()
+def sweep_intermediates(data, psg, sample_rate=100, epoch_sec=30, lowcut=3.0, highcut=11.0, order=1,
+                        scale=1.0, offset=0.0):
+    """
+    Computes every threshold independent quantity of one subject.
+
+    Parameters
+    ----------
+    data : array_like
+        accelerometer axis aligned with gravity (e.g. z/4.0 of ICHI14)
+    psg : array_like
+        polysomnography label of each sample
+    sample_rate : int
+        (default = 100)
+    epoch_sec : int
+        length of the Cole epochs in seconds (default = 30), Oakley and Sazonov
+        always use one minute epochs
+    lowcut, highcut : float
+        bandpass cutoffs used for the activity counts
+    order : int
+        bandpass filter order
+    scale, offset : float
+        units of raw integer readings, (data-offset)*scale (see loaders)
+
+    Return
+    ----------
+    inter : dict
+        sigma, psg_second - per-second standard deviation and PSG wake
+        cole_ps, psg_epoch - Cole score and PSG wake per epoch_sec epoch
+        oakley_ps, sazonov_ps, psg_minute - scores and PSG wake per minute
+    """
+    data = np.asarray(data)
+    psg = np.asarray(psg)
+    filtered = bandpass(data, lowcut, highcut, sample_rate, order, scale, offset)
+    cole_counts = activity_counts(filtered, sample_rate, epoch_sec)[0]
+    oakley_counts = activity_counts(filtered, sample_rate, MINUTE_SEC)[1]
+    sigma = per_second_std(data, sample_rate, scale)
+    peaks = (epoch_max(data, sample_rate, MINUTE_SEC).astype(filtered.dtype) - offset) * scale
+
+    return {
+        'sample_rate': sample_rate,
+        'sigma': sigma,
+        'psg_second': psg_wake(psg[::sample_rate][:len(sigma)]),
+        'cole_ps': cole_ps(cole_counts),
+        'oakley_ps': oakley_ps(oakley_counts),
+        'sazonov_ps': sazonov_ps(peaks),
+        'psg_epoch': psg_wake(psg[::epoch_sec*sample_rate][:len(cole_counts)]),
+        'psg_minute': psg_wake(psg[::MINUTE_SEC*sample_rate][:len(oakley_counts)]),
+    }
+
+
+def segment_mask(segments, n):
+    """Per-second sleep mask (True as sleep) of [start, end, is_sleep] segments, gaps are not sleep."""
+    mask = np.zeros(n, dtype=bool)
+    for start, end, is_sleep in segments:
+        mask[start:end] = bool(is_sleep)
+    return mask
+
+
+def run_edges(flags):
+    """
+    Runs of equal values in every row of a 2d bool array, from one comparison of
+    neighbouring columns.
+
+    Return
+    ----------
+    runs : list
+        per row the starts, (exclusive) ends and values of its runs
+    """
+    flags = np.asarray(flags, dtype=bool)
+    change = flags[:, 1:] != flags[:, :-1]
+    runs = []
+    for row, changes in zip(flags, change):
+        starts = np.concatenate(([0], np.flatnonzero(changes) + 1)) if len(row) else np.zeros(0, dtype=int)
+        ends = np.append(starts[1:], len(row))
+        runs.append((starts, ends, row[starts]))
+    return runs
+
+
+def runs_sleep_segments(starts, ends, still, n, sleep_threshold):
+    """
+    sleep_segments() from the runs of bool_sigma. The scan jumps between still runs
+    of at least sleep_threshold seconds (or reaching the end) instead of testing
+    every second; the segments are the same.
+    """
+    starts, ends = starts[still], ends[still]
+    usable = (ends - starts >= sleep_threshold) | (ends == n)
+    starts, ends = starts[usable], ends[usable]
+
+    def next_still(index):
+        #First second from index on whose window of sleep_threshold seconds is still
+        if index >= n:
+            return index
+        k = np.searchsorted(ends, index, side='right')
+        if k < len(ends):
+            first = max(starts[k], index)
+            if ends[k] == n or ends[k] - first >= sleep_threshold:
+                return first
+            if k + 1 < len(ends):
+                return starts[k+1]
+        return n
+
+    start_index = -1
+    j = -1
+    sleep_indices = []
+    while start_index <= n:
+        start_index = int(next_still(start_index + 1))
+
+        if not sleep_indices:
+            sleep_indices.append([0, start_index, False])
+        elif (start_index-sleep_indices[-1][1]) < (sleep_threshold//3):
+            sleep_indices[-1][1] = start_index
+        else:
+            sleep_indices.append([sleep_indices[-1][1], start_index, False])
+
+        #The still run covers the whole window, so the next movement is its end
+        if start_index+sleep_threshold < n:
+            end = int(ends[np.searchsorted(ends, start_index, side='right')])
+            if end < n:
+                j = end
+                sleep_indices.append([start_index, j, True])
+                start_index = j
+            else:
+                j = n-1
+
+        if j == n-1:
+            sleep_indices.append([start_index, j, True])
+            break
+
+    return sleep_indices
+
+
+def runs_length_scores(starts, ends, still, sleep_threshold):
+    """
+    run_length_scores() from the runs of bool_sigma. Segment sizes come from a
+    cumulative sum, the scores use the same floating point operations.
+    """
+    lengths = ends - starts
+    sizes = np.concatenate(([0], np.cumsum(lengths)))
+    scores = []
+    first = 0
+    for i in range(len(lengths)):
+        size = sizes[i] - sizes[first]
+        if lengths[i] > sleep_threshold or size > sleep_threshold:
+            if size:
+                arl = np.mean(lengths[first:i])
+                scores.append(np.full(size, np.mean(lengths[first:i] / arl * still[first:i])))
+            if lengths[i] > sleep_threshold:
+                scores.append(np.full(lengths[i], float(still[i])))
+                first = i + 1
+            else:
+                first = i
+    return np.concatenate(scores) if scores else np.zeros(0)
+
+
+def scores_sleep_mask(bool_scores, n):
+    """
+    Per-second sleep masks of score_segments() for every row of thresholded run
+    length scores: sleep where the score is not below rl_threshold, and in wake
+    runs shorter than 3 minutes that do not start the recording.
+    """
+    bool_scores = np.atleast_2d(bool_scores)
+    m = min(bool_scores.shape[1], n)
+    mask = np.zeros((len(bool_scores), n), dtype=bool)
+    mask[:, :m] = ~bool_scores[:, :m]
+    for row, (starts, ends, wake) in zip(mask, run_edges(bool_scores)):
+        short = wake & (ends - starts < 180) & (starts > 0)
+        for start, end in zip(starts[short], ends[short]):
+            row[start:min(end, n)] = True
+    return mask
+
+
+@profiled(samples=None)
+def evaluate_grid(inter, grid=None):
+    """
+    Agreement with the PSG for every point of the threshold grid.
+
+    Parameters
+    ----------
+    inter : dict
+        output of sweep_intermediates()
+    grid : dict
+        threshold values, keys as in DEFAULT_GRID (default = DEFAULT_GRID).
+        sleep_sec is the still window of accel_sleep in seconds, i.e. its
+        sleep_threshold divided by the sample rate (6000 at 10 Hz = 600)
+
+    Return
+    ----------
+    results : dict
+        per algorithm the swept thresholds and the fraction of epochs (seconds for
+        accel_sleep, minutes for Oakley and Sazonov) where the predicted
+        sleep-wake matches the PSG
+    """
+    grid = dict(DEFAULT_GRID, **(grid or {}))
+    psg_epoch = inter['psg_epoch']
+    psg_minute = inter['psg_minute']
+    psg_sleep = ~inter['psg_second']
+    results = {'cole': {'agreement': np.mean((inter['cole_ps'] >= 1) == psg_epoch)}}
+
+    #Oakley scores wake above the threshold, Sazonov scores sleep above it
+    oakley = np.asarray(grid['oakley'], dtype=float)
+    oakley_wake = inter['oakley_ps'][np.newaxis, :] > oakley[:, np.newaxis]
+    results['oakley'] = {'threshold': oakley,
+                         'agreement': (oakley_wake == psg_minute).mean(axis=1)}
+
+    sazonov = np.asarray(grid['sazonov'], dtype=float)
+    sazonov_wake = ~(inter['sazonov_ps'][np.newaxis, :] > sazonov[:, np.newaxis])
+    results['sazonov'] = {'threshold': sazonov,
+                          'agreement': (sazonov_wake == psg_minute).mean(axis=1)}
+
+    #accel_sleep and accel_sleep_weighted share the thresholded sigma and run length scores
+    movement = np.asarray(grid['movement_threshold'], dtype=float)
+    sleep = np.asarray(grid['sleep_sec'])
+    rl = np.asarray(grid['rl_threshold'], dtype=float)
+    bool_sigma = inter['sigma'][np.newaxis, :] < movement[:, np.newaxis]
+    n = len(psg_sleep)
+
+    #Runs are found once per movement threshold, every sleep_sec reuses them
+    sleep_masks = np.zeros((len(movement), len(sleep), n), dtype=bool)
+    weighted_masks = np.zeros((len(movement), len(sleep), len(rl), n), dtype=bool)
+    for i, (starts, ends, still) in enumerate(run_edges(bool_sigma)):
+        for j, sleep_sec in enumerate(sleep.astype(int)):
+            sleep_masks[i, j] = segment_mask(runs_sleep_segments(starts, ends, still, n, sleep_sec), n)
+            sleep_scores = runs_length_scores(starts, ends, still, sleep_sec)
+            weighted_masks[i, j] = scores_sleep_mask(sleep_scores[np.newaxis, :] < rl[:, np.newaxis], n)
+    ess = (sleep_masks == psg_sleep).mean(axis=-1)
+    weighted = (weighted_masks == psg_sleep).mean(axis=-1)
+
+    results['accel_sleep'] = {'movement_threshold': movement, 'sleep_sec': sleep,
+                              'agreement': ess}
+    results['accel_sleep_weighted'] = {'movement_threshold': movement, 'sleep_sec': sleep,
+                                       'rl_threshold': rl, 'agreement': weighted}
+    return results
+
+
+def sweep_subject(data, psg, grid=None, **kwargs):
+    """Threshold sweep of one subject, kwargs are passed to sweep_intermediates()."""
+    return evaluate_grid(sweep_intermediates(data, psg, **kwargs), grid)
+
+
+def _sweep_source(args):
+    loader, source, grid, kwargs = args
+    data, psg = loader(source) if loader is not None else source
+    return sweep_subject(data, psg, grid, **kwargs)
+
+
+def sweep_cohort(subjects, grid=None, loader=None, max_workers=None, **kwargs):
+    """
+    Threshold sweep of a whole cohort, one subject per worker process.
+
+    Parameters
+    ----------
+    subjects : dict
+        subject name to either a (data, psg) tuple or, if loader is given, the
+        argument of loader (e.g. a file name) so that loading happens in the worker
+    grid : dict
+        threshold values, keys as in DEFAULT_GRID
+    loader : callable
+        module level function returning (data, psg) for one subject
+    max_workers : int
+        number of worker processes (default = number of CPUs)
+
+    Return
+    ----------
+    results : dict
+        subject name to the output of evaluate_grid()
+    """
+    names = list(subjects)
+    jobs = [(loader, subjects[name], grid, kwargs) for name in names]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(names, executor.map(_sweep_source, jobs)))
+
+
+def cohort_agreement(results):
+    """Mean agreement over all subjects of sweep_cohort() for every algorithm and grid point."""
+    algorithms = next(iter(results.values())).keys()
+    return {algo: np.mean([res[algo]['agreement'] for res in results.values()], axis=0)
+            for algo in algorithms}
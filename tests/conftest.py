@@ -0,0 +1,9 @@
+import os
+import sys
+
+
+#The sleep_wake package and the standalone script directories are imported from the checkout
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'past_research'), os.path.join(ROOT, 'notebooks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,107 @@
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from filters import bandpass_filter, lowpass_filter
+from sleep_wake import accel_sleep, cole_ps, oakley_ps, loaders
+from sleep_wake.counts import bandpass, activity_counts
+
+
+"""
+Compact dtype pipeline (load_ichi14 raw counts, float32 filtering) against the
+float64 load_data DataFrame and bandpass_filter path of SleepStages.ipynb on a
+synthetic ICHI14 night, one sample per stored row as in load_data.
+"""
+
+ICHI14_DTYPE = np.dtype([('t', '<f8'), ('d', '<i8'), ('x', 'u1'), ('y', 'u1'), ('z', 'u1'),
+                         ('l', 'u1'), ('gt', 'u1')])
+
+
+@pytest.fixture(scope='module')
+def night(tmp_path_factory):
+    """
+    An hour at 100 Hz with one sample per stored row. At rest the z posture drifts
+    by single counts every ten seconds or so, with four bouts of movement.
+    """
+    rng = np.random.default_rng(0)
+    n = 360000
+    rec = np.zeros(n, ICHI14_DTYPE)
+    rec['t'] = 736000 + np.arange(n) / 100 / 86400
+    rec['d'] = 1
+    z = 160 + np.cumsum(np.where(rng.random(n) < .001, rng.choice([-1, 1], n), 0)).astype(float)
+    for _ in range(4):
+        start = rng.integers(0, n - 3000)
+        z[start:start+3000] += rng.normal(0, 8, 3000)
+    rec['z'] = np.clip(z, 0, 255).astype(np.uint8)
+    rec['x'] = 128
+    rec['y'] = 130
+    rec['gt'] = rng.choice([0, 1, 2, 3, 5, 6], n)
+    path = str(tmp_path_factory.mktemp('ichi14') / 'night.npy')
+    np.save(path, rec)
+    return path
+
+
+def float64_pipeline(path):
+    #load_data of SleepStages.ipynb without changing directory
+    local = datetime.strptime("0001-01-01", "%Y-%m-%d")
+    df = pd.DataFrame(np.load(path).view(np.recarray))
+    df['dtime'] = df['t'].apply(lambda x: (local + timedelta(x)).strftime('%Y-%m-%d %H:%M:%S.%f'))
+    df['psg'] = df['gt']
+    df = df[df['psg'] != 0].reset_index(drop=True)
+    for axis in 'zxy':
+        df[axis + '_bp'] = bandpass_filter(df[axis] / 4.0, 3.0, 11.0, 100.0, 1, False)
+    df['z_lp'] = lowpass_filter(df['z'] / 4.0, 10.0, 100.0)
+    counts = activity_counts(df['z_bp'].values)
+    segments = accel_sleep((((df['z'] - 128) / 32) * 9.81).values[::10], 10, .2, 6000)
+    return counts, segments
+
+
+def compact_pipeline(path):
+    rec = loaders.load_ichi14(path, expand=False)
+    filtered = [bandpass(rec[axis], 3.0, 11.0, 100, 1, loaders.COUNTS_SCALE) for axis in 'zxy']
+    lowpass_filter(rec['z'], 10.0, 100.0)
+    counts = activity_counts(filtered[0])
+    segments = accel_sleep(rec['z'][::10], 10, .2, 6000, scale=loaders.GRAVITY_SCALE)
+    return counts, segments
+
+
+def traced(func, *args):
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+@pytest.fixture(scope='module')
+def runs(night):
+    return traced(float64_pipeline, night), traced(compact_pipeline, night)
+
+
+def test_peak_memory_per_night(runs):
+    (_, float64_peak), (_, compact_peak) = runs
+    assert float64_peak >= 4 * compact_peak
+
+
+def test_accel_sleep_segments_unchanged(runs):
+    ((_, expected), _), ((_, result), _) = runs
+    assert result == expected
+
+
+def test_accel_sleep_finds_sleep(runs):
+    ((_, expected), _), _ = runs
+    assert any(is_sleep for start, end, is_sleep in expected)
+
+
+def test_cole_oakley_decisions_unchanged(runs):
+    (((cole64, oakley64), _), _), (((cole32, oakley32), _), _) = runs
+    np.testing.assert_array_equal(cole32, cole64)
+    np.testing.assert_allclose(oakley32, oakley64, rtol=1e-4, atol=1e-3)
+    np.testing.assert_array_equal(cole_ps(cole32) >= 1, cole_ps(cole64) >= 1)
+    for threshold in (20, 40, 80):
+        np.testing.assert_array_equal(oakley_ps(oakley32) > threshold, oakley_ps(oakley64) > threshold)
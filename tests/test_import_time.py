@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+
+
+"""
+Import-time regression test of the sleep_wake core. Importing the package must only
+load NumPy; SciPy, pandas, matplotlib and scikit-learn belong to the lazily loaded
+submodules and the notebooks.
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('scipy', 'pandas', 'matplotlib', 'sklearn')
+MAX_IMPORT_SEC = 1.0
+
+
+def import_profile():
+    """Cumulative import time of sleep_wake in seconds and the top-level modules loaded."""
+    code = "import sys, sleep_wake; print(' '.join(sorted({m.split('.')[0] for m in sys.modules})))"
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                         capture_output=True, text=True, check=True)
+
+    #importtime lines are "import time: self [us] | cumulative | imported package"
+    cumulative = None
+    for line in out.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == 'sleep_wake':
+            cumulative = int(fields[1]) / 1e6
+    return cumulative, set(out.stdout.split())
+
+
+def test_core_import_skips_heavy_deps():
+    loaded = import_profile()[1]
+    assert 'sleep_wake' in loaded
+    assert not loaded.intersection(HEAVY)
+
+
+def test_core_import_time():
+    cumulative = import_profile()[0]
+    assert cumulative is not None
+    assert cumulative < MAX_IMPORT_SEC
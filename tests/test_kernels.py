@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from sleep_wake import kernels
+
+
+"""
+Kernels of sleep_wake.kernels against their pure Python/NumPy fallbacks through
+check_kernels(); run with -s to see the measured speedups.
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def report(**kwargs):
+    rows = kernels.check_kernels(**kwargs)
+    for name, row in rows.items():
+        print('%-20s numba=%s fallback=%.4fs kernel=%.4fs speedup=%.1fx'
+              % (name, kernels.numba_available(), row['fallback_s'], row['kernel_s'], row['speedup']))
+    return rows
+
+
+def test_kernels_match_fallbacks():
+    rows = report(n_seconds=7200, repeat=1)
+    assert {'sleep_segments', 'orientation_changes'} <= set(rows)
+    assert all(row['identical'] for row in rows.values())
+
+
+def test_peakdetect_kernel_matches_package():
+    pytest.importorskip('peakdetect')
+    assert report(n_seconds=7200, repeat=1)['peakdetect']['identical']
+
+
+@pytest.mark.skipif(not kernels.numba_available(), reason='numba is not installed')
+def test_compiled_kernels_match_fallbacks():
+    enabled = kernels.numba_enabled()
+    try:
+        kernels.use_numba(True)
+        rows = report()
+        assert all(row['identical'] for row in rows.values())
+    finally:
+        kernels.use_numba(enabled)
+
+
+def test_benchmark_entry_point_warns_nothing():
+    out = subprocess.run([sys.executable, '-W', 'error', '-m', 'sleep_wake.bench_kernels', '--seconds', '3600',
+                          '--repeat', '1'], cwd=ROOT, capture_output=True, text=True)
+    assert out.returncode == 0, out.stderr
+    assert not out.stderr
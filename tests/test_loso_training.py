@@ -0,0 +1,60 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+import loso_training
+from sleep_wake import evaluation
+
+
+"""
+Leave-one-subject-out runner on a small synthetic cohort: fold scores against
+evaluation.evaluate_cohort, shared memory cleanup and the exported scaling function.
+"""
+
+SHM = '/dev/shm'
+
+
+@pytest.fixture(scope='module')
+def cohort():
+    """Four subjects of stages 1-3; one feature is constant and one epoch is NaN."""
+    rng = np.random.default_rng(0)
+    features, labels = {}, {}
+    for subject in range(4):
+        y = rng.integers(1, 4, 120)
+        x = rng.normal(size=(120, 4))
+        x[:, 0] += 2 * y
+        x[:, 3] = 5.0
+        x[7, 1] = np.nan
+        features['s%d' % subject] = x
+        labels['s%d' % subject] = y
+    return features, labels
+
+
+@pytest.mark.skipif(not os.path.isdir(SHM), reason='no /dev/shm')
+def test_loso_scores_match_evaluate_cohort(cohort):
+    before = set(os.listdir(SHM))
+    scores, predictions = loso_training.run_loso(*cohort, max_workers=2)
+    assert set(os.listdir(SHM)) == before
+
+    expected = evaluation.evaluate_cohort(predictions, classes=(1, 2, 3), wake=(3,))
+    assert list(expected['subject']) == list(scores['subject'])
+    np.testing.assert_array_equal(expected['epochs'], scores['epochs'])
+    np.testing.assert_allclose(expected['accuracy'], scores['accuracy'])
+    np.testing.assert_allclose(expected['kappa'], scores['kappa'])
+
+    #Every epoch keeps its position, the NaN epoch is predicted as MISSING
+    for subject, (true, pred) in predictions.items():
+        assert len(pred) == len(cohort[1][subject[0]])
+        assert pred[7] == loso_training.MISSING
+
+
+def test_exported_scaler_shape(cohort, tmp_path):
+    scaling, classifier = loso_training.train_final(*cohort)
+    scaling_file, classifier_file = str(tmp_path / 'scaling.pkl'), str(tmp_path / 'classifier.pkl')
+    loso_training.export_model(scaling, classifier, scaling_file, classifier_file)
+    with open(scaling_file, 'rb') as f:
+        exported = pickle.load(f)
+    assert exported.shape == (4, 2)
+    assert exported[3, 1] == 1
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from sleep_wake import store
+
+
+"""
+Parquet store round trip: two nights of one subject, a rewritten night and a
+compacted index, queried through stage_fractions and the time-range filter.
+"""
+
+NIGHTS = {'2017-03-01': np.datetime64('2017-03-01T23:00'), '2017-03-02': np.datetime64('2017-03-02T23:00')}
+
+
+def write(root, night, stage):
+    start = NIGHTS[night] + np.arange(len(stage)) * np.timedelta64(30, 's')
+    store.write_night(root, 'p01', night, 'svc', start, np.asarray(stage), features={'std': np.ones(len(stage))})
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = str(tmp_path)
+    write(root, '2017-03-01', [1] * 60 + [4] * 20 + [0] * 20)
+    write(root, '2017-03-02', [1] * 100)
+    #The second night is rescored, only its latest partition counts
+    write(root, '2017-03-02', [1] * 50 + [4] * 50)
+    store.compact_index(root)
+    return root
+
+
+def test_stage_fractions(root):
+    fractions = store.stage_fractions(root, [4])
+    assert len(fractions) == 1
+    row = fractions.iloc[0]
+    assert (row['subject'], row['algorithm'], row['nights'], row['epochs']) == ('p01', 'svc', 2, 200)
+    assert row['fraction'] == pytest.approx(70 / 200)
+
+    epochs = store.read_epochs(root, columns=['stage'])
+    assert len(epochs) == 200
+    assert (epochs['stage'] == 4).sum() == 70
+
+
+def test_time_range_filter(root):
+    second = store.stage_fractions(root, [4], start=np.datetime64('2017-03-02T12:00'))
+    assert list(second['nights']) == [1]
+    assert second['fraction'].iloc[0] == pytest.approx(.5)
+
+    first = store.query_index(root, end=np.datetime64('2017-03-02T12:00'))
+    assert list(first['night']) == ['2017-03-01']
+
+    both = store.query_index(root, start=np.datetime64('2017-03-01T23:30'), end=np.datetime64('2017-03-02T23:00'))
+    assert list(both['night']) == ['2017-03-01', '2017-03-02']
+
+
+def test_rewrite_after_compaction(root):
+    write(root, '2017-03-01', [4] * 100)
+    index = store.read_index(root)
+    assert len(index) == 2
+    assert store.stage_fractions(root, [4])['fraction'].iloc[0] == pytest.approx(150 / 200)